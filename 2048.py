@@ -6,6 +6,13 @@ Clone of 2048 game.
 import numeric
 import random
 import math
+import time
+import collections
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Directions, DO NOT MODIFY
 UP = 1
@@ -61,9 +68,12 @@ class TwentyFortyEight:
     Class to run the game logic.
     """
 
-    def __init__(self, grid_height, grid_width):
+    def __init__(self, grid_height, grid_width, rng=None):
         self._height = grid_height
         self._width = grid_width
+        self._rng = rng
+        if rng is None:
+            self._rng = random
         self.reset()
     
     def reset(self):
@@ -71,6 +81,21 @@ class TwentyFortyEight:
         Reset the game so the grid is empty.
         """
         self._grid = [[0 for dummy_row in range(self._width)] for dummy_col in range(self._height)]
+        # Squares of each line in each direction, from the edge tiles move to
+        self._lines = {}
+        for direction, (row_off, col_off) in OFFSETS.items():
+            if direction == UP or direction == DOWN:
+                starts = [(0 if direction == UP else self._height - 1, col)
+                          for col in range(self._width)]
+                length = self._height
+            else:
+                starts = [(row, 0 if direction == LEFT else self._width - 1)
+                          for row in range(self._height)]
+                length = self._width
+            self._lines[direction] = [[(row + step * row_off, col + step * col_off)
+                                       for step in range(length)]
+                                      for row, col in starts]
+        self.rebuild_empty()
     
     def __str__(self):
         """
@@ -98,14 +123,17 @@ class TwentyFortyEight:
         Move all tiles in the given direction and add
         a new tile if any tiles moved.
         """
-        new_d = {1: 3, 2: 1, 3: 0, 4: 2}
-        for dummy_kdx in range(new_d.get(direction)):
-            self.transpose()
-        for idx in range(self._height):
-            merge(self._grid[idx])
-        for dummy_jdx in range(4 - new_d.get(direction)):
-            self.transpose()
-        self.new_tile()
+        changed = False
+        for squares in self._lines[direction]:
+            line = [self._grid[row][col] for row, col in squares]
+            merged = merge(list(line))
+            # set_tile keeps the empty squares up to date
+            for idx in range(len(squares)):
+                if merged[idx] != line[idx]:
+                    changed = True
+                    self.set_tile(squares[idx][0], squares[idx][1], merged[idx])
+        if changed:
+            self.new_tile()
         
         
     def new_tile(self):
@@ -114,25 +142,83 @@ class TwentyFortyEight:
         square.  The tile should be 2 90% of the time and
         4 10% of the time.
         """
-        zero_found = False
-        row_shuf = range(self._height)
-        random.shuffle(row_shuf)
-        col_shuf = range(self._width)
-        random.shuffle(col_shuf)
-        for row in row_shuf:
-            for col in col_shuf:
-                if self.get_tile(row, col) == 0: 
-                    self.set_tile(row, col, random.choice([2, 2, 2, 2, 2, 2, 2, 2, 2, 4]))
-                    zero_found = True
+        if self._empty:
+            row, col = self._rng.choice(self._empty)
+            self.set_tile(row, col, self._rng.choice([2, 2, 2, 2, 2, 2, 2, 2, 2, 4]))
+
+    def rebuild_empty(self):
+        """
+        Rebuild the list of empty squares from the grid.
+        """
+        self._empty = []
+        self._empty_index = {}
+        for row in range(self._height):
+            for col in range(self._width):
+                if self._grid[row][col] == 0:
+                    self._empty_index[(row, col)] = len(self._empty)
+                    self._empty.append((row, col))
+
+    def update_empty(self, row, col, value):
+        """
+        Add or remove the square row, col from the list of empty
+        squares when its value changes. Removal swaps the square with
+        the last one of the list so both take constant time.
+        """
+        square = (row, col)
+        if value == 0 and square not in self._empty_index:
+            self._empty_index[square] = len(self._empty)
+            self._empty.append(square)
+        elif value != 0 and square in self._empty_index:
+            idx = self._empty_index.pop(square)
+            last = self._empty.pop()
+            if last != square:
+                self._empty[idx] = last
+                self._empty_index[last] = idx
+
+    def legal_moves(self):
+        """
+        Return the list of directions that would move a tile.
+        A direction is legal if some tile has an empty or equal
+        neighbor on the side it moves to.
+        """
+        legal = []
+        for direction in [UP, DOWN, LEFT, RIGHT]:
+            row_off, col_off = OFFSETS[direction]
+            found = False
+            for row in range(max(0, row_off), self._height + min(0, row_off)):
+                for col in range(max(0, col_off), self._width + min(0, col_off)):
+                    tile = self._grid[row][col]
+                    target = self._grid[row - row_off][col - col_off]
+                    if tile != 0 and (target == 0 or target == tile):
+                        found = True
+                        break
+                if found:
                     break
-            if zero_found == True:
-                break          
+            if found:
+                legal.append(direction)
+        return legal
+
+    def is_game_over(self):
+        """
+        Return True if no move can change the grid.
+        """
+        if self._empty:
+            return False
+        for row in range(self._height):
+            for col in range(self._width):
+                tile = self._grid[row][col]
+                if row + 1 < self._height and self._grid[row + 1][col] == tile:
+                    return False
+                if col + 1 < self._width and self._grid[row][col + 1] == tile:
+                    return False
+        return True
         
     def set_tile(self, row, col, value):
         """
         Set the tile at position row, col to have the given value.
         """        
         self._grid[row][col] = value
+        self.update_empty(row, col, value)
 
     def get_tile(self, row, col):
         """
@@ -158,5 +244,819 @@ class TwentyFortyEight:
         
  
     
-#poc_2048_gui.run_gui(TwentyFortyEight(4, 4))
+# Bitboard backend for the 4x4 game.
+# The grid is packed in a single 64 bit integer, one 4 bit nibble per tile
+# holding the exponent of the tile value (0 for an empty square, 1 for 2,
+# 2 for 4, ... 15 for 32768). Row r lives in bits 16 * r to 16 * r + 15
+# and column c of a row lives in bits 4 * c to 4 * c + 3 of that row.
+ROW_MASK = 0xFFFF
+MAX_EXPONENT = 15
+
+# Lookup tables indexed by a 16 bit row, filled by build_move_tables()
+ROW_LEFT_TABLE = []
+ROW_RIGHT_TABLE = []
+COL_UP_TABLE = []
+COL_DOWN_TABLE = []
+ROW_SCORE_TABLE = []
+
+
+def reverse_row(row):
+    """
+    Reverse the order of the four nibbles of a 16 bit row.
+    """
+    return ((row >> 12) | ((row >> 4) & 0x00F0) |
+            ((row << 4) & 0x0F00) | ((row << 12) & 0xF000))
+
+
+def unpack_col(row):
+    """
+    Spread the four nibbles of a 16 bit row down column zero of a board.
+    """
+    return ((row & 0x000F) | ((row & 0x00F0) << 12) |
+            ((row & 0x0F00) << 24) | ((row & 0xF000) << 36))
+
+
+def transpose_board(board):
+    """
+    Transpose a 64 bit board so that rows become columns.
+    """
+    diag1 = board & 0xF0F00F0FF0F00F0F
+    diag2 = board & 0x0000F0F00000F0F0
+    diag3 = board & 0x0F0F00000F0F0000
+    board = diag1 | (diag2 << 12) | (diag3 >> 12)
+    diag1 = board & 0xFF00FF0000FF00FF
+    diag2 = board & 0x00FF00FF00000000
+    diag3 = board & 0x00000000FF00FF00
+    return diag1 | (diag2 >> 24) | (diag3 << 24)
+
+
+def build_move_tables():
+    """
+    Precompute the result of moving every possible 16 bit row.
+    The row tables hold the new row and the column tables hold the
+    difference to xor into a column. Built once, on first use, with
+    merge so that both backends agree.
+    """
+    if ROW_LEFT_TABLE:
+        return
+    left = [0] * (ROW_MASK + 1)
+    for row in range(ROW_MASK + 1):
+        line = [(row >> (4 * idx)) & 0xF for idx in range(4)]
+        line = merge([(1 << exp) if exp else 0 for exp in line])
+        result = 0
+        for idx in range(4):
+            if line[idx]:
+                exp = min(int(math.log(line[idx], 2) + 0.5), MAX_EXPONENT)
+                result |= exp << (4 * idx)
+        left[row] = result
+    for row in range(ROW_MASK + 1):
+        right = reverse_row(left[reverse_row(row)])
+        ROW_LEFT_TABLE.append(left[row])
+        ROW_RIGHT_TABLE.append(right)
+        COL_UP_TABLE.append(unpack_col(row) ^ unpack_col(left[row]))
+        COL_DOWN_TABLE.append(unpack_col(row) ^ unpack_col(right))
+        # Score of all the merges needed to build the tiles of the row
+        score = 0
+        for idx in range(4):
+            exp = (row >> (4 * idx)) & 0xF
+            if exp >= 2:
+                score += (exp - 1) << exp
+        ROW_SCORE_TABLE.append(score)
+
+
+def move_board(board, direction):
+    """
+    Return the 64 bit board obtained by moving all tiles of the
+    given board in the given direction, without adding a new tile.
+    """
+    if direction == LEFT or direction == RIGHT:
+        if direction == LEFT:
+            table = ROW_LEFT_TABLE
+        else:
+            table = ROW_RIGHT_TABLE
+        return (table[board & ROW_MASK] |
+                (table[(board >> 16) & ROW_MASK] << 16) |
+                (table[(board >> 32) & ROW_MASK] << 32) |
+                (table[(board >> 48) & ROW_MASK] << 48))
+    if direction == UP:
+        table = COL_UP_TABLE
+    else:
+        table = COL_DOWN_TABLE
+    trans = transpose_board(board)
+    return (board ^ table[trans & ROW_MASK] ^
+            (table[(trans >> 16) & ROW_MASK] << 4) ^
+            (table[(trans >> 32) & ROW_MASK] << 8) ^
+            (table[(trans >> 48) & ROW_MASK] << 12))
+
+
+class BitboardTwentyFortyEight:
+    """
+    Class to run the game logic on a 4x4 bitboard.
+    Same interface as TwentyFortyEight.
+    """
+
+    def __init__(self, grid_height=4, grid_width=4, rng=None):
+        assert grid_height == 4 and grid_width == 4, "bitboard is 4x4 only"
+        self._height = grid_height
+        self._width = grid_width
+        self._rng = rng
+        if rng is None:
+            self._rng = random
+        build_move_tables()
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the game so the grid is empty.
+        """
+        self._board = 0
+        self._score = 0
+
+    def __str__(self):
+        """
+        Return a string representation of the grid for debugging.
+        """
+        result = ""
+        for row in range(self._height):
+            result += "\n" + str([self.get_tile(row, col)
+                                  for col in range(self._width)])
+        return result
+
+    def get_grid_height(self):
+        """
+        Get the height of the board.
+        """
+        return self._height
+
+    def get_grid_width(self):
+        """
+        Get the width of the board.
+        """
+        return self._width
+
+    def get_board(self):
+        """
+        Return the packed 64 bit board.
+        """
+        return self._board
+
+    def get_score(self):
+        """
+        Return the sum of the values of all the tiles merged so far.
+        """
+        return self._score
+
+    def move(self, direction):
+        """
+        Move all tiles in the given direction and add
+        a new tile if any tiles moved.
+        """
+        new_board = move_board(self._board, direction)
+        if new_board != self._board:
+            # Merging two 2**k tiles adds 2**(k+1) to the row score
+            for shift in [0, 16, 32, 48]:
+                self._score += ROW_SCORE_TABLE[(new_board >> shift) & ROW_MASK]
+                self._score -= ROW_SCORE_TABLE[(self._board >> shift) & ROW_MASK]
+            self._board = new_board
+            self.new_tile()
+
+    def legal_moves(self):
+        """
+        Return the list of directions that would move a tile.
+        """
+        return [direction for direction in [UP, DOWN, LEFT, RIGHT]
+                if move_board(self._board, direction) != self._board]
+
+    def is_game_over(self):
+        """
+        Return True if no move can change the grid.
+        """
+        return not self.legal_moves()
+
+    def new_tile(self):
+        """
+        Create a new tile in a randomly selected empty
+        square.  The tile should be 2 90% of the time and
+        4 10% of the time.
+        """
+        empty = [shift for shift in range(0, 64, 4)
+                 if not (self._board >> shift) & 0xF]
+        if empty:
+            exp = self._rng.choice([1, 1, 1, 1, 1, 1, 1, 1, 1, 2])
+            self._board |= exp << self._rng.choice(empty)
+
+    def set_tile(self, row, col, value):
+        """
+        Set the tile at position row, col to have the given value.
+        """
+        shift = 4 * (4 * row + col)
+        exp = 0
+        if value:
+            exp = int(math.log(value, 2) + 0.5)
+        self._board = (self._board & ~(0xF << shift)) | (exp << shift)
+
+    def get_tile(self, row, col):
+        """
+        Return the value of the tile at position row, col.
+        """
+        exp = (self._board >> (4 * (4 * row + col))) & 0xF
+        if exp:
+            return 1 << exp
+        return 0
+
+
+def benchmark_backends(num_moves=20000):
+    """
+    Play num_moves random moves on the list backend and on the
+    bitboard backend and print the moves per second of each.
+    """
+    build_move_tables()
+    for game_class in [TwentyFortyEight, BitboardTwentyFortyEight]:
+        random.seed(0)
+        game = game_class(4, 4)
+        game.new_tile()
+        start = time.time()
+        for dummy_idx in range(num_moves):
+            game.move(random.choice([UP, DOWN, LEFT, RIGHT]))
+            if 0 not in [game.get_tile(row, col)
+                         for row in range(4) for col in range(4)]:
+                game.reset()
+                game.new_tile()
+        elapsed = time.time() - start
+        print(game_class.__name__ + ": " +
+              str(int(num_moves / elapsed)) + " moves/s")
+
+
+# Expectimax player.
+# Searches the bitboard: max nodes try the four moves and chance nodes
+# average over every empty square getting a 2 (90%) or a 4 (10%).
+# Leaves are scored with a per row heuristic table.
+HEURISTIC_EMPTY_WEIGHT = 270.0
+HEURISTIC_MERGE_WEIGHT = 700.0
+HEURISTIC_MONOTONIC_WEIGHT = 47.0
+HEURISTIC_MONOTONIC_POWER = 4.0
+HEURISTIC_SUM_WEIGHT = 11.0
+HEURISTIC_SUM_POWER = 3.5
+HEURISTIC_LOST_PENALTY = 200000.0
+
+# Chance branches less likely than this are scored by the heuristic
+MIN_PROBABILITY = 0.0001
+
+# Heuristic score of every 16 bit row, filled by build_heuristic_table()
+HEURISTIC_TABLE = []
+
+
+def build_heuristic_table():
+    """
+    Precompute the heuristic score of every possible 16 bit row.
+    Rewards empty squares, adjacent equal tiles (merges) and rows that
+    are monotonic, and penalizes large tiles away from the edges.
+    """
+    if HEURISTIC_TABLE:
+        return
+    for row in range(ROW_MASK + 1):
+        line = [(row >> (4 * idx)) & 0xF for idx in range(4)]
+        empty = line.count(0)
+        merges = 0
+        previous = 0
+        counter = 0
+        for exp in line:
+            if exp == 0:
+                continue
+            if exp == previous:
+                counter += 1
+            elif counter > 0:
+                merges += 1 + counter
+                counter = 0
+            previous = exp
+        if counter > 0:
+            merges += 1 + counter
+        mono_left = 0.0
+        mono_right = 0.0
+        for idx in range(3):
+            low = line[idx] ** HEURISTIC_MONOTONIC_POWER
+            high = line[idx + 1] ** HEURISTIC_MONOTONIC_POWER
+            if line[idx] > line[idx + 1]:
+                mono_left += low - high
+            else:
+                mono_right += high - low
+        total = sum([exp ** HEURISTIC_SUM_POWER for exp in line])
+        HEURISTIC_TABLE.append(HEURISTIC_LOST_PENALTY +
+                               HEURISTIC_EMPTY_WEIGHT * empty +
+                               HEURISTIC_MERGE_WEIGHT * merges -
+                               HEURISTIC_MONOTONIC_WEIGHT *
+                               min(mono_left, mono_right) -
+                               HEURISTIC_SUM_WEIGHT * total)
+
+
+def score_board(board):
+    """
+    Heuristic score of a 64 bit board, summed over its rows and columns.
+    """
+    trans = transpose_board(board)
+    return (HEURISTIC_TABLE[board & ROW_MASK] +
+            HEURISTIC_TABLE[(board >> 16) & ROW_MASK] +
+            HEURISTIC_TABLE[(board >> 32) & ROW_MASK] +
+            HEURISTIC_TABLE[(board >> 48) & ROW_MASK] +
+            HEURISTIC_TABLE[trans & ROW_MASK] +
+            HEURISTIC_TABLE[(trans >> 16) & ROW_MASK] +
+            HEURISTIC_TABLE[(trans >> 32) & ROW_MASK] +
+            HEURISTIC_TABLE[(trans >> 48) & ROW_MASK])
+
+
+def board_from_game(game):
+    """
+    Pack the tiles of a 4x4 game (any backend) into a 64 bit board.
+    """
+    board = 0
+    for row in range(4):
+        for col in range(4):
+            value = game.get_tile(row, col)
+            if value:
+                exp = int(math.log(value, 2) + 0.5)
+                board |= exp << (4 * (4 * row + col))
+    return board
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the move time budget runs out.
+    """
+    pass
+
+
+class ExpectimaxPlayer:
+    """
+    Depth limited expectimax player for the 4x4 game.
+    Deepens the search one level at a time until the time budget is
+    used, or to max_depth when time_budget is None, and keeps an LRU
+    transposition cache of chance node values.
+    """
+
+    def __init__(self, time_budget=0.1, max_depth=6, cache_size=200000):
+        self._time_budget = time_budget
+        self._max_depth = max_depth
+        self._cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._deadline = None
+        self._nodes = 0
+        self._cache_hits = 0
+        self._total_nodes = 0
+        self._total_time = 0.0
+        self._depth = 0
+        build_move_tables()
+        build_heuristic_table()
+
+    def get_move(self, game):
+        """
+        Return the best direction for the given game, or None if
+        no move changes the board.
+        """
+        board = board_from_game(game)
+        start = time.time()
+        self._deadline = None
+        if self._time_budget is not None:
+            self._deadline = start + self._time_budget
+        self._nodes = 0
+        self._cache_hits = 0
+        best_move = None
+        self._depth = 0
+        for depth in range(1, self._max_depth + 1):
+            try:
+                move = self.search_root(board, depth)
+            except SearchTimeout:
+                break
+            if move is None:
+                break
+            best_move = move
+            self._depth = depth
+            if self._deadline is not None and time.time() >= self._deadline:
+                break
+        if best_move is None:
+            # Out of time before depth 1 finished, pick any legal move
+            for direction in [UP, LEFT, RIGHT, DOWN]:
+                if move_board(board, direction) != board:
+                    best_move = direction
+                    break
+        self._total_nodes += self._nodes
+        self._total_time += time.time() - start
+        return best_move
+
+    def search_root(self, board, depth):
+        """
+        Return the direction with the highest expected score when
+        searching depth moves ahead.
+        """
+        best_score = None
+        best_move = None
+        for direction in [UP, LEFT, RIGHT, DOWN]:
+            new_board = move_board(board, direction)
+            if new_board == board:
+                continue
+            score = self.chance_node(new_board, depth - 1, 1.0)
+            if best_score is None or score > best_score:
+                best_score = score
+                best_move = direction
+        return best_move
+
+    def max_node(self, board, depth, probability):
+        """
+        Expected score of the best move from board.
+        """
+        self._nodes += 1
+        if (self._deadline is not None and self._nodes & 0x3FF == 0 and
+                time.time() > self._deadline):
+            raise SearchTimeout()
+        best_score = 0.0
+        for direction in [UP, LEFT, RIGHT, DOWN]:
+            new_board = move_board(board, direction)
+            if new_board != board:
+                best_score = max(best_score,
+                                 self.chance_node(new_board, depth - 1,
+                                                  probability))
+        return best_score
+
+    def chance_node(self, board, depth, probability):
+        """
+        Expected score of board over all possible new tiles.
+        """
+        if depth <= 0 or probability < MIN_PROBABILITY:
+            self._nodes += 1
+            return score_board(board)
+        key = (board, depth)
+        if key in self._cache:
+            self._cache_hits += 1
+            score = self._cache.pop(key)
+            self._cache[key] = score
+            return score
+        empty = [shift for shift in range(0, 64, 4)
+                 if not (board >> shift) & 0xF]
+        score = 0.0
+        if empty:
+            probability /= len(empty)
+            for shift in empty:
+                score += 0.9 * self.max_node(board | (1 << shift), depth,
+                                             probability * 0.9)
+                score += 0.1 * self.max_node(board | (2 << shift), depth,
+                                             probability * 0.1)
+            score /= len(empty)
+        self._cache[key] = score
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(False)
+        return score
+
+    def get_stats(self):
+        """
+        Return a dictionary with the statistics of the last move and
+        the average nodes per second over all moves so far.
+        """
+        nodes_per_second = 0.0
+        if self._total_time > 0:
+            nodes_per_second = self._total_nodes / self._total_time
+        return {"nodes": self._nodes,
+                "depth": self._depth,
+                "cache_hits": self._cache_hits,
+                "cache_size": len(self._cache),
+                "nodes_per_second": nodes_per_second}
+
+
+def play_expectimax(time_budget=0.1, max_moves=10000):
+    """
+    Play one game with the expectimax player and print the final
+    grid, the number of moves and the search speed.
+    """
+    game = BitboardTwentyFortyEight(4, 4)
+    game.new_tile()
+    game.new_tile()
+    player = ExpectimaxPlayer(time_budget)
+    moves = 0
+    while moves < max_moves:
+        direction = player.get_move(game)
+        if direction is None:
+            break
+        game.move(direction)
+        moves += 1
+    print(str(game))
+    print("moves: " + str(moves) + ", nodes/s: " +
+          str(int(player.get_stats()["nodes_per_second"])))
+
+
+# Batch backend.
+# Holds many games in a single (games, height, width) numpy array of tile
+# values and applies the same move to all of them at once.
+
+class BatchTwentyFortyEight:
+    """
+    Class to run the game logic of many games at once with numpy.
+    """
+
+    def __init__(self, num_games, grid_height, grid_width, seed=None):
+        assert numpy is not None, "BatchTwentyFortyEight needs numpy"
+        self._num_games = num_games
+        self._height = grid_height
+        self._width = grid_width
+        self._rng = numpy.random.RandomState(seed)
+        self.reset()
+
+    def reset(self):
+        """
+        Reset all the games so the grids are empty.
+        """
+        self._grids = numpy.zeros((self._num_games, self._height,
+                                   self._width), dtype=numpy.int64)
+
+    def __str__(self):
+        """
+        Return a string representation of the grids for debugging.
+        """
+        return str(self._grids)
+
+    def get_num_games(self):
+        """
+        Get the number of games in the batch.
+        """
+        return self._num_games
+
+    def get_grid_height(self):
+        """
+        Get the height of the boards.
+        """
+        return self._height
+
+    def get_grid_width(self):
+        """
+        Get the width of the boards.
+        """
+        return self._width
+
+    def get_grids(self):
+        """
+        Return the (games, height, width) array of tile values.
+        """
+        return self._grids
+
+    def get_tile(self, game, row, col):
+        """
+        Return the value of the tile at position row, col of a game.
+        """
+        return int(self._grids[game, row, col])
+
+    def set_tile(self, game, row, col, value):
+        """
+        Set the tile at position row, col of a game to the given value.
+        """
+        self._grids[game, row, col] = value
+
+    def move(self, direction):
+        """
+        Move all tiles of every game in the given direction and add a
+        new tile to the games where any tile moved.
+        Returns two arrays with one entry per game: whether the move
+        changed the grid and the score gained by merges.
+        """
+        new_grids, scores = self.slide(direction)
+        moved = (new_grids != self._grids).any(axis=2).any(axis=1)
+        self._grids = new_grids
+        self.new_tile(moved)
+        return moved, scores
+
+    def slide(self, direction):
+        """
+        Return the grids after moving in the given direction, without
+        new tiles, and the score gained by each game.
+        """
+        # Orient the grids so that every move is a move to the left
+        grids = self._grids
+        if direction == UP or direction == DOWN:
+            grids = grids.transpose(0, 2, 1)
+        if direction == RIGHT or direction == DOWN:
+            grids = grids[:, :, ::-1]
+        lines = grids.reshape(-1, grids.shape[2])
+        lines, scores = merge_lines(lines)
+        grids = lines.reshape(grids.shape)
+        if direction == RIGHT or direction == DOWN:
+            grids = grids[:, :, ::-1]
+        if direction == UP or direction == DOWN:
+            grids = grids.transpose(0, 2, 1)
+        scores = scores.reshape(self._num_games, -1).sum(axis=1)
+        return numpy.ascontiguousarray(grids), scores
+
+    def new_tile(self, mask=None):
+        """
+        Create a new tile in a randomly selected empty square of each
+        game selected by the boolean mask (all games by default). The
+        tile should be 2 90% of the time and 4 10% of the time.
+        """
+        flat = self._grids.reshape(self._num_games, -1)
+        keys = self._rng.random_sample(flat.shape)
+        keys[flat != 0] = -1.0
+        squares = keys.argmax(axis=1)
+        games = numpy.arange(self._num_games)
+        spawn = keys[games, squares] >= 0
+        if mask is not None:
+            spawn &= mask
+        values = numpy.where(self._rng.random_sample(self._num_games) < 0.9,
+                             2, 4)
+        flat[games[spawn], squares[spawn]] = values[spawn]
+
+    def legal_moves(self):
+        """
+        Return a (games, 4) boolean array telling which of UP, DOWN,
+        LEFT and RIGHT change each grid.
+        """
+        legal = numpy.zeros((self._num_games, 4), dtype=bool)
+        for direction in [UP, DOWN, LEFT, RIGHT]:
+            new_grids = self.slide(direction)[0]
+            legal[:, direction - 1] = (new_grids != self._grids).any(
+                axis=2).any(axis=1)
+        return legal
+
+
+def merge_lines(lines):
+    """
+    Merge every row of a 2D array of tile values to the left, like merge.
+    Returns the merged rows and the score gained by each row.
+    """
+    lines = compact_lines(lines)
+    scores = numpy.zeros(lines.shape[0], dtype=numpy.int64)
+    for idx in range(lines.shape[1] - 1):
+        same = (lines[:, idx] == lines[:, idx + 1]) & (lines[:, idx] != 0)
+        lines[same, idx] *= 2
+        lines[same, idx + 1] = 0
+        scores[same] += lines[same, idx]
+    return compact_lines(lines), scores
+
+
+def compact_lines(lines):
+    """
+    Slide the non zero tiles of every row of a 2D array to the left,
+    keeping their order.
+    """
+    order = numpy.argsort(lines == 0, axis=1, kind="mergesort")
+    return numpy.take_along_axis(lines, order, axis=1)
+
+
+def benchmark_batch(num_games=1000, num_moves=100):
+    """
+    Play num_games random games of num_moves moves with the batch
+    backend and print the moves per second.
+    """
+    batch = BatchTwentyFortyEight(num_games, 4, 4, 0)
+    batch.new_tile()
+    start = time.time()
+    for dummy_idx in range(num_moves):
+        batch.move(random.choice([UP, DOWN, LEFT, RIGHT]))
+    elapsed = time.time() - start
+    print("BatchTwentyFortyEight: " +
+          str(int(num_games * num_moves / elapsed)) + " moves/s")
 
+
+# Tournament runner.
+# Plays many games per policy on a process pool. Every game gets its own
+# random.Random seeded from the tournament seed and the game number, so
+# results do not depend on which worker plays the game or in what order.
+# Expectimax searches to a fixed depth with no time budget, so its moves
+# do not depend on CPU load either.
+TOURNAMENT_EXPECTIMAX_DEPTH = 2
+TOURNAMENT_FIELDS = ["policy", "game", "seed", "max_tile", "score",
+                     "moves", "wall_time"]
+
+# Players of the game being played, created on first use and dropped
+# at the start of every game so no cache carries over between games
+TOURNAMENT_PLAYERS = {}
+
+
+def policy_random(game, rng):
+    """
+    Pick a random legal direction.
+    """
+    return rng.choice(game.legal_moves())
+
+
+def policy_corner(game, rng):
+    """
+    Prefer UP, then LEFT, then RIGHT, then DOWN.
+    """
+    legal = game.legal_moves()
+    for direction in [UP, LEFT, RIGHT, DOWN]:
+        if direction in legal:
+            return direction
+
+
+def policy_expectimax(game, rng):
+    """
+    Pick the move of a fixed depth expectimax search.
+    """
+    if "expectimax" not in TOURNAMENT_PLAYERS:
+        TOURNAMENT_PLAYERS["expectimax"] = ExpectimaxPlayer(
+            None, TOURNAMENT_EXPECTIMAX_DEPTH)
+    return TOURNAMENT_PLAYERS["expectimax"].get_move(game)
+
+
+TOURNAMENT_POLICIES = {"random": policy_random,
+                       "corner": policy_corner,
+                       "expectimax": policy_expectimax}
+
+
+def play_tournament_game(task):
+    """
+    Play one game for the tournament.
+    task is a tuple (policy name, game number, seed).
+    Returns a dictionary with the TOURNAMENT_FIELDS of the game.
+    """
+    policy_name, game_number, seed = task
+    policy = TOURNAMENT_POLICIES[policy_name]
+    rng = random.Random(seed)
+    build_move_tables()
+    TOURNAMENT_PLAYERS.clear()
+    start = time.time()
+    game = BitboardTwentyFortyEight(4, 4, rng)
+    game.new_tile()
+    game.new_tile()
+    moves = 0
+    while not game.is_game_over():
+        game.move(policy(game, rng))
+        moves += 1
+    max_tile = max([game.get_tile(row, col)
+                    for row in range(4) for col in range(4)])
+    return {"policy": policy_name,
+            "game": game_number,
+            "seed": seed,
+            "max_tile": max_tile,
+            "score": game.get_score(),
+            "moves": moves,
+            "wall_time": time.time() - start}
+
+
+def run_tournament(policy_names, num_games, output_path, processes=None,
+                   seed=0, summary_every=100):
+    """
+    Play num_games games for each named policy on a pool of worker
+    processes. Results are written to output_path as they complete, as
+    CSV if the name ends in .csv and as JSON lines otherwise, and a
+    running summary is printed every summary_every games.
+    Returns a dictionary mapping each policy to its number of games,
+    total score and best tile.
+    """
+    import multiprocessing
+    import json
+    import csv
+    tasks = []
+    for policy_name in policy_names:
+        assert policy_name in TOURNAMENT_POLICIES, "unknown " + policy_name
+        for game_number in range(num_games):
+            tasks.append((policy_name, game_number,
+                          seed * 1000003 + game_number))
+    summary = {}
+    for policy_name in policy_names:
+        summary[policy_name] = {"games": 0, "score": 0, "max_tile": 0}
+    pool = multiprocessing.Pool(processes)
+    output = open(output_path, "w")
+    writer = None
+    if output_path.endswith(".csv"):
+        writer = csv.DictWriter(output, TOURNAMENT_FIELDS)
+        writer.writeheader()
+    start = time.time()
+    done = 0
+    try:
+        for result in pool.imap_unordered(play_tournament_game, tasks):
+            if writer is not None:
+                writer.writerow(result)
+            else:
+                output.write(json.dumps(result, sort_keys=True) + "\n")
+            output.flush()
+            stats = summary[result["policy"]]
+            stats["games"] += 1
+            stats["score"] += result["score"]
+            stats["max_tile"] = max(stats["max_tile"], result["max_tile"])
+            done += 1
+            if done % summary_every == 0 or done == len(tasks):
+                print_tournament_summary(summary, done, time.time() - start)
+    finally:
+        output.close()
+        pool.close()
+        pool.join()
+    return summary
+
+
+def print_tournament_summary(summary, done, elapsed):
+    """
+    Print the games played, throughput and per policy averages.
+    """
+    line = str(done) + " games, " + str(round(done / max(elapsed, 1e-9), 1))
+    line += " games/s"
+    for policy_name in sorted(summary):
+        stats = summary[policy_name]
+        if stats["games"]:
+            line += (" | " + policy_name + ": mean score " +
+                     str(stats["score"] // stats["games"]) +
+                     ", best tile " + str(stats["max_tile"]))
+    print(line)
+
+
+#poc_2048_gui.run_gui(TwentyFortyEight(4, 4))
+#poc_2048_gui.run_gui(BitboardTwentyFortyEight(4, 4))
+#benchmark_backends()
+#play_expectimax()
+#benchmark_batch()
+#run_tournament(["random", "corner", "expectimax"], 100, "tournament.jsonl")
@@ -4,6 +4,8 @@ Cookie Clicker Simulator
 
 import simpleplot
 import math
+import array
+import heapq
 
 # Used to increase the timeout, if necessary
 import codeskulptor
@@ -14,17 +16,139 @@ import poc_clicker_provided as provided
 # Constants
 SIM_TIME = 10000000000.0
 
+class CompactHistory:
+    """
+    History list stored in typed arrays, with item names interned
+    to small integers. Behaves like a list of
+    (time, item, cost of item, total cookies) tuples.
+
+    max_entries bounds the number of entries kept in memory: either
+    the most recent ones (at least half of max_entries) or, with
+    downsample, every stride-th entry where the stride doubles each
+    time the store fills up. Entries can also be written as CSV lines
+    to an open file stream as they are added, flushing every
+    flush_every entries and on flush. Streaming does not drop entries
+    from memory: without max_entries every entry is still kept.
+    """
+
+    def __init__(self, max_entries=None, downsample=False, stream=None, flush_every=1000):
+        self._times = array.array("d")
+        self._costs = array.array("d")
+        self._totals = array.array("d")
+        self._items = array.array("H")
+        self._names = []
+        self._name_ids = {}
+        self._max_entries = max_entries
+        self._downsample = downsample
+        self._stride = 1
+        self._count = 0
+        self._stream = stream
+        self._flush_every = flush_every
+
+    def intern(self, item_name):
+        """
+        Return the small integer standing for an item name
+        """
+        if item_name not in self._name_ids:
+            self._name_ids[item_name] = len(self._names)
+            self._names.append(item_name)
+        return self._name_ids[item_name]
+
+    def append(self, entry):
+        """
+        Add a (time, item, cost of item, total cookies) entry
+        """
+        if self._stream != None:
+            self._stream.write("%r,%s,%r,%r\n" % (entry[0], entry[1], entry[2], entry[3]))
+            if (self._count + 1) % self._flush_every == 0:
+                self._stream.flush()
+        self._count += 1
+        if (self._count - 1) % self._stride != 0:
+            return
+        self._times.append(entry[0])
+        self._items.append(self.intern(entry[1]))
+        self._costs.append(entry[2])
+        self._totals.append(entry[3])
+        if self._max_entries != None and len(self._times) > self._max_entries:
+            if self._downsample:
+                # Keep every other entry and only store half as often
+                self._stride *= 2
+                drop = slice(1, None, 2)
+            else:
+                # Drop the oldest entries in one go, amortized constant time
+                drop = slice(0, len(self._times) - max(self._max_entries // 2, 1))
+            for store in [self._times, self._items, self._costs, self._totals]:
+                del store[drop]
+
+    def flush(self):
+        """
+        Flush the entries written to the stream so far
+        """
+        if self._stream != None:
+            self._stream.flush()
+
+    def get_count(self):
+        """
+        Return the number of entries ever added
+        """
+        return self._count
+
+    def __len__(self):
+        """
+        Return the number of entries kept in memory
+        """
+        return len(self._times)
+
+    def __getitem__(self, idx):
+        """
+        Return the entry or list of entries at idx
+        """
+        if isinstance(idx, slice):
+            return [self[jdx] for jdx in range(*idx.indices(len(self)))]
+        return (self._times[idx], self._names[self._items[idx]],
+                self._costs[idx], self._totals[idx])
+
+    def __iter__(self):
+        """
+        Iterate over the entries kept in memory
+        """
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __eq__(self, other):
+        """
+        Compare the entries with a list of entries
+        """
+        if not isinstance(other, (list, CompactHistory)):
+            return False
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        """
+        Negation of __eq__
+        """
+        return not self == other
+
+    def __repr__(self):
+        """
+        Return the entries as a list representation
+        """
+        return repr(list(self))
+
 class ClickerState:
     """
     Simple class to keep track of the game state.
     """
     
-    def __init__(self):
+    def __init__(self, history=None):
         self._totalcookies = 0.0
         self._currentcookies = 0.0
         self._time = 0.0
         self._cps = 1.0
-        self._history = [(0.0, None, 0.0, 0.0)]
+        if history is None:
+            history = []
+        self._history = history
+        self._history.append((0.0, None, 0.0, 0.0))
         
     def __str__(self):
         """
@@ -49,6 +173,14 @@ class ClickerState:
         """
         return self._cps
     
+    def get_total_cookies(self):
+        """
+        Get total number of cookies produced so far
+
+        Should return a float
+        """
+        return self._totalcookies
+
     def get_time(self):
         """
         Get current time
@@ -102,25 +234,48 @@ class ClickerState:
         self._currentcookies -= cost
         self._cps += additional_cps
         self._history.append((self._time, item_name, cost, self._totalcookies))
+
+    def set_state(self, time, current_cookies, total_cookies, cps, history):
+        """
+        Overwrite the whole state, used by the fast simulator
+        """
+        self._time = time
+        self._currentcookies = current_cookies
+        self._totalcookies = total_cookies
+        self._cps = cps
+        self._history = history
    
     
-def simulate_clicker(build_info, duration, strategy):
+def finish_history(state):
+    """
+    Flush the history of a finished game if it streams its entries,
+    so the last partial block is written. Returns the state.
+    """
+    history = state.get_history()
+    if isinstance(history, CompactHistory):
+        history.flush()
+    return state
+
+def simulate_clicker(build_info, duration, strategy, history=None):
     """
     Function to run a Cookie Clicker game for the given
     duration with the given strategy.  Returns a ClickerState
     object corresponding to game.
+    history is an optional empty store for the history, such
+    as a CompactHistory, used instead of a list, and flushed when
+    the game ends.
     """
     ugrades = build_info.clone()
-    state = ClickerState()
+    state = ClickerState(history)
     strname = strategy(state.get_cookies(), state.get_cps(), duration - state.get_time(), ugrades)
     while state.get_time() <= duration :
         strname = strategy(state.get_cookies(), state.get_cps(), duration - state.get_time(), ugrades)
         if strname == None :
             state.wait(duration - state.get_time())
-            return state
+            return finish_history(state)
         elif ugrades.get_cost(strname) > state.get_cookies() + (duration - state.get_time()) * state.get_cps():
             state.wait(duration - state.get_time())
-            return state
+            return finish_history(state)
         else:
             cost = ugrades.get_cost(strname)
             state.wait(state.time_until(cost))
@@ -131,7 +286,329 @@ def simulate_clicker(build_info, duration, strategy):
     state.buy_item(strname, ugrades.get_cost(strname), ugrades.get_cps(strname))
     ugrades.update_item(strname)
     
-    return state
+    return finish_history(state)
+
+
+class CostCurveBuildInfo:
+    """
+    Build info with the cost of every purchase of every item kept
+    on a cost curve shared by all the clones, so update_item just
+    moves along the curve. The curves are extended on demand with
+    a scratch copy of the build info, using the same arithmetic.
+    """
+
+    def __init__(self, build_info, counts=None, curves=None, cps=None):
+        if curves == None:
+            # The scratch copy is always at the end of the curves and
+            # is shared with every clone
+            build_info = build_info.clone()
+            curves = {}
+            cps = {}
+        self._scratch = build_info
+        self._curves = curves
+        self._cps = cps
+        if counts == None:
+            counts = dict.fromkeys(build_info.build_items(), 0)
+        self._counts = counts
+
+    def build_items(self):
+        """
+        Get a list of buildable items
+        """
+        return self._scratch.build_items()
+
+    def get_cost(self, item):
+        """
+        Get the current cost of an item
+        """
+        try:
+            return self._curves[item][self._counts[item]]
+        except (KeyError, IndexError):
+            return self.get_cost_at(item, 0)
+
+    def get_cps(self, item):
+        """
+        Get the current CPS of an item
+        """
+        if item not in self._cps:
+            self.get_cost_at(item, 0)
+        return self._cps[item]
+
+    def get_cost_at(self, item, purchases):
+        """
+        Get the cost of an item after purchases more purchases,
+        extending the curve with the same arithmetic as BuildInfo
+        """
+        count = self._counts[item] + purchases
+        curve = self._curves.get(item)
+        if curve == None:
+            curve = [self._scratch.get_cost(item)]
+            self._curves[item] = curve
+            self._cps[item] = self._scratch.get_cps(item)
+        while len(curve) <= count:
+            self._scratch.update_item(item)
+            curve.append(self._scratch.get_cost(item))
+        return curve[count]
+
+    def update_item(self, item):
+        """
+        Move to the next cost of the item
+        """
+        self.get_cost_at(item, 1)
+        self._counts[item] += 1
+
+    def clone(self):
+        """
+        Return a clone of this object, sharing the cost curves
+        and the scratch copy that extends them
+        """
+        return CostCurveBuildInfo(self._scratch, dict(self._counts), self._curves, self._cps)
+
+
+def simulate_clicker_fast(build_info, duration, strategy, history=None):
+    """
+    Same per purchase loop as simulate_clicker, which already jumps
+    straight to the time of each purchase, made a constant factor
+    faster: the state is kept in local variables, the costs are read
+    from cost curves and the strategies get an IndexedBuildInfo so
+    they do not scan the items. Returns a ClickerState with the same
+    history as simulate_clicker.
+    """
+    curves = CostCurveBuildInfo(build_info)
+    ugrades = IndexedBuildInfo(curves)
+    get_cost = curves.get_cost
+    get_cps = curves.get_cps
+    update_item = ugrades.update_item
+    now = 0.0
+    cookies = 0.0
+    total = 0.0
+    cps = 1.0
+    state = ClickerState(history)
+    history = state.get_history()
+    while now <= duration:
+        strname = strategy(cookies, cps, duration - now, ugrades)
+        if strname == None:
+            break
+        cost = get_cost(strname)
+        if cost > cookies + (duration - now) * cps:
+            break
+        if cost > cookies:
+            wait = math.ceil((cost - cookies) / cps)
+            now += wait
+            cookies += cps * wait
+            total += cps * wait
+        additional_cps = get_cps(strname)
+        if cost <= cookies and additional_cps > 0:
+            cookies -= cost
+            cps += additional_cps
+            history.append((now, strname, cost, total))
+        update_item(strname)
+    else:
+        # The last wait went past duration, buy once more like simulate_clicker
+        state.set_state(now, cookies, total, cps, history)
+        strname = strategy(cookies, cps, duration - now, ugrades)
+        state.buy_item(strname, get_cost(strname), get_cps(strname))
+        return finish_history(state)
+    if duration - now > 0:
+        cookies += cps * (duration - now)
+        total += cps * (duration - now)
+        now += duration - now
+    state.set_state(now, cookies, total, cps, history)
+    return finish_history(state)
+
+
+def benchmark_simulate(strategy, duration=SIM_TIME, runs=10):
+    """
+    Time simulate_clicker and simulate_clicker_fast with the same
+    strategy, check that the histories match and print the speedup
+    """
+    import time
+    start = time.time()
+    for dummy_idx in range(runs):
+        slow = simulate_clicker(provided.BuildInfo(), duration, strategy)
+    slow_time = time.time() - start
+    start = time.time()
+    for dummy_idx in range(runs):
+        fast = simulate_clicker_fast(provided.BuildInfo(), duration, strategy)
+    fast_time = time.time() - start
+    assert slow.get_history() == fast.get_history(), "histories differ"
+    print strategy.__name__, ":", slow_time / runs, "s vs", fast_time / runs, "s,",
+    print "speedup", slow_time / max(fast_time, 1e-9)
+
+
+class IndexedBuildInfo:
+    """
+    Wrapper around a build info that keeps the items in heaps, so the
+    strategies can pick an item without scanning all of them. Ties are
+    broken by the order of build_items like the scans do.
+
+    A min-heap by cost gives the cheapest item. For the budget of a
+    query the items are split in two: a min-heap by cost holds the
+    items costing at least the budget, and a max-heap by cost and a
+    min-heap by cost/CPS hold the items costing less. A query first
+    moves the items whose cost crossed the budget since the last query
+    to the other side, then reads the top of a heap, so it is O(log n)
+    plus O(log n) per item moved. update_item pushes the new entries in
+    O(log n). The old entries of an updated or moved item are skipped
+    when they reach the top, and a heap is rebuilt in O(n) once it
+    holds several times more entries than items.
+
+    Each heap is only built by the first query that needs it, so a
+    strategy only pays for the heaps it uses.
+    """
+
+    def __init__(self, build_info):
+        self._info = build_info
+        self._items = None
+        self._by_cost = None
+        self._above = None
+        self._below_cost = None
+        self._below_ratio = None
+
+    def build_index(self):
+        """
+        Record the order, current cost and entry version of every item
+        """
+        self._items = self._info.build_items()
+        self._order = {}
+        self._cost = {}
+        self._version = {}
+        for order in range(len(self._items)):
+            item = self._items[order]
+            self._order[item] = order
+            self._cost[item] = self._info.get_cost(item)
+            self._version[item] = 0
+
+    def build_items(self):
+        """
+        Get a list of buildable items
+        """
+        return self._info.build_items()
+
+    def get_cost(self, item):
+        """
+        Get the current cost of an item
+        """
+        return self._info.get_cost(item)
+
+    def get_cps(self, item):
+        """
+        Get the current CPS of an item
+        """
+        return self._info.get_cps(item)
+
+    def update_item(self, item):
+        """
+        Update the item and push its new cost in the heaps in use
+        """
+        self._info.update_item(item)
+        if self._items == None:
+            return
+        cost = self._info.get_cost(item)
+        order = self._order[item]
+        self._cost[item] = cost
+        self._version[item] += 1
+        limit = 4 * len(self._items)
+        if self._by_cost != None:
+            heapq.heappush(self._by_cost, (cost, order, item))
+            if len(self._by_cost) > limit:
+                self._by_cost = None
+        if self._above != None:
+            heapq.heappush(self._above, (cost, order, item, self._version[item]))
+            if len(self._above) + len(self._below_cost) > limit:
+                self._above = None
+
+    def clone(self):
+        """
+        Return a clone of this object
+        """
+        return IndexedBuildInfo(self._info.clone())
+
+    def cheapest_item(self):
+        """
+        Return the cheapest item, the first one in build_items on ties
+        """
+        if self._items == None:
+            self.build_index()
+        if self._by_cost == None:
+            self._by_cost = [(self._cost[item], self._order[item], item) for item in self._items]
+            heapq.heapify(self._by_cost)
+        heap = self._by_cost
+        while heap[0][0] != self._cost[heap[0][2]]:
+            heapq.heappop(heap)
+        return heap[0][2]
+
+    def split(self, budget):
+        """
+        Move the items whose cost crossed budget to the right side,
+        so the items costing less than budget are exactly the live
+        entries of the max-heap by cost
+        """
+        if self._items == None:
+            self.build_index()
+        version = self._version
+        if self._above == None:
+            # Start again with every item costing at least the budget
+            self._above = [(self._cost[item], self._order[item], item, version[item])
+                           for item in self._items]
+            heapq.heapify(self._above)
+            self._below_cost = []
+            if self._below_ratio != None:
+                self._below_ratio = []
+        above = self._above
+        below = self._below_cost
+        ratios = self._below_ratio
+        while above and above[0][0] < budget:
+            cost, order, item, entry_version = heapq.heappop(above)
+            if entry_version == version[item]:
+                version[item] += 1
+                heapq.heappush(below, (-cost, order, item, version[item]))
+                if ratios != None:
+                    heapq.heappush(ratios, (cost / self._info.get_cps(item), order,
+                                            item, version[item]))
+        while below and (below[0][3] != version[below[0][2]] or -below[0][0] >= budget):
+            neg_cost, order, item, entry_version = heapq.heappop(below)
+            if entry_version == version[item]:
+                version[item] += 1
+                heapq.heappush(above, (-neg_cost, order, item, version[item]))
+
+    def cost_reaches(self, budget):
+        """
+        Return True if some item costs exactly budget
+        """
+        self.split(budget)
+        above = self._above
+        while above and above[0][3] != self._version[above[0][2]]:
+            heapq.heappop(above)
+        return len(above) > 0 and above[0][0] == budget
+
+    def most_expensive_below(self, budget):
+        """
+        Return the most expensive item costing less than budget,
+        the first one in build_items on ties, or None
+        """
+        self.split(budget)
+        if not self._below_cost:
+            return None
+        return self._below_cost[0][2]
+
+    def best_ratio_below(self, budget):
+        """
+        Return the item with the lowest cost/CPS among the items costing
+        less than budget, the first one in build_items on ties, or None
+        """
+        self.split(budget)
+        if self._below_ratio == None:
+            self._below_ratio = [(-neg_cost / self._info.get_cps(item), order, item, entry_version)
+                                 for neg_cost, order, item, entry_version in self._below_cost
+                                 if entry_version == self._version[item]]
+            heapq.heapify(self._below_ratio)
+        heap = self._below_ratio
+        while heap and heap[0][3] != self._version[heap[0][2]]:
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        return heap[0][2]
 
 
 def strategy_cursor(cookies, cps, time_left, build_info):
@@ -159,7 +636,11 @@ def strategy_cheap(cookies, cps, time_left, build_info):
     Builds items and return the cheaper one
     Searches over the list of items
     """
-    
+    if isinstance(build_info, IndexedBuildInfo):
+        cheaper = build_info.cheapest_item()
+        if build_info.get_cost(cheaper) > cookies + time_left * cps:
+            return None
+        return cheaper
     itemlist = build_info.build_items()
     cheaper = itemlist[0]
     for item in itemlist:
@@ -174,6 +655,9 @@ def strategy_expensive(cookies, cps, time_left, build_info):
     Builds items and return the more expensive one
     Searches over the list of items
     """
+    budget = cookies + time_left * cps
+    if isinstance(build_info, IndexedBuildInfo) and not build_info.cost_reaches(budget):
+        return build_info.most_expensive_below(budget)
     itemlist = build_info.build_items()
     expen = ""
     for item in itemlist:
@@ -191,6 +675,9 @@ def strategy_best(cookies, cps, time_left, build_info):
     """
     Best strategy choses the item with the lowest cost/cps
     """
+    budget = cookies + time_left * cps
+    if isinstance(build_info, IndexedBuildInfo) and not build_info.cost_reaches(budget):
+        return build_info.best_ratio_below(budget)
     itemlist = build_info.build_items()
     best = ""
     for item in itemlist:
@@ -204,21 +691,180 @@ def strategy_best(cookies, cps, time_left, build_info):
             best = item
     return best
         
+class PlannerStrategy:
+    """
+    Strategy that plans the whole sequence of purchases with a depth
+    first branch and bound search, then replays the plan.
+
+    Search states are the item counts and the time; a state is pruned
+    when a state with the same counts in the same time bucket had at
+    least as many cookies, or when an upper bound on the cookies it can
+    still produce cannot beat the best plan found. The search stops
+    after time_budget seconds or once max_states states are memoized
+    and no new ones fit, and keeps the best plan found, which is never
+    worse than the greedy cost/CPS plan it finds first.
+
+    An instance is called like any strategy function and plans again
+    only when the game does not follow its plan (for example a new
+    simulation), so the other calls are constant time.
+    """
+
+    def __init__(self, time_budget=1.0, max_states=200000, time_buckets=1000):
+        self._time_budget = time_budget
+        self._max_states = max_states
+        self._time_buckets = time_buckets
+        self._plan = []
+        self._expected = []
+        self._step = 0
+        self._last_call = None
+        self._last_answer = None
+        self._stats = {}
+
+    def __call__(self, cookies, cps, time_left, build_info):
+        """
+        Return the next item of the plan, or None
+        """
+        call = (cookies, cps, time_left)
+        if call == self._last_call:
+            return self._last_answer
+        if not self.follows_plan(cps, time_left):
+            self.make_plan(cookies, cps, time_left, build_info)
+        answer = None
+        if self._step < len(self._plan):
+            answer = self._plan[self._step]
+        self._step += 1
+        self._last_call = call
+        self._last_answer = answer
+        return answer
+
+    def follows_plan(self, cps, time_left):
+        """
+        Check whether the game is in the state the plan expects
+        """
+        if self._step >= len(self._expected):
+            return False
+        expected_cps, expected_time_left = self._expected[self._step]
+        return (abs(cps - expected_cps) <= 1e-9 * expected_cps and
+                abs(time_left - expected_time_left) <= 1e-6 * max(expected_time_left, 1.0))
+
+    def get_stats(self):
+        """
+        Return a dictionary with the statistics of the last search
+        """
+        return dict(self._stats)
+
+    def make_plan(self, cookies, cps, time_left, build_info):
+        """
+        Search the best sequence of purchases from the given state
+        and store it as the plan
+        """
+        import time
+        deadline = time.time() + self._time_budget
+        curves = CostCurveBuildInfo(build_info)
+        items = [item for item in build_info.build_items() if build_info.get_cps(item) > 0]
+        item_cps = [build_info.get_cps(item) for item in items]
+        bucket = max(time_left / self._time_buckets, 1.0)
+        memo = {}
+
+        def children(now, cookies, cps, counts):
+            """
+            Purchases that can be made next in the time left, as
+            (cost/CPS, item index, cost, wait), best ratio last
+            """
+            result = []
+            for idx in range(len(items)):
+                cost = curves.get_cost_at(items[idx], counts[idx])
+                if cost > cookies + (time_left - now) * cps:
+                    continue
+                wait = 0.0
+                if cost > cookies:
+                    wait = math.ceil((cost - cookies) / cps)
+                if now + wait <= time_left:
+                    result.append((cost / item_cps[idx], idx, cost, wait))
+            result.sort(reverse=True)
+            return result
+
+        def upper_bound(now, cookies, cps, counts):
+            """
+            Cookies that could still be produced if the cookies in hand
+            and every cookie produced were reinvested at once at the
+            best current cost/CPS ratio, which only gets worse
+            """
+            left = time_left - now
+            if not items:
+                return cps * left
+            ratio = min([curves.get_cost_at(items[idx], counts[idx]) / item_cps[idx]
+                         for idx in range(len(items))])
+            if left / ratio > 700:
+                return float("inf")
+            return (cps + cookies / ratio) * ratio * (math.exp(left / ratio) - 1)
+
+        # Each stack frame is [now, cookies, produced, cps, counts, children]
+        stack = [[0.0, cookies, 0.0, cps, (0,) * len(items),
+                  children(0.0, cookies, cps, (0,) * len(items))]]
+        path = []
+        best_value = -1.0
+        best_path = []
+        expanded = 0
+        while stack:
+            now, cur_cookies, produced, cur_cps, counts, options = stack[-1]
+            if not options:
+                # Every purchase from here is explored, score stopping here
+                value = produced + cur_cps * (time_left - now)
+                if value > best_value:
+                    best_value = value
+                    best_path = list(path)
+                stack.pop()
+                if path:
+                    path.pop()
+                continue
+            if best_path and time.time() > deadline:
+                break
+            idx, cost, wait = options.pop()[1:]
+            new_counts = counts[:idx] + (counts[idx] + 1,) + counts[idx + 1:]
+            new_now = now + wait
+            new_cookies = cur_cookies + cur_cps * wait - cost
+            new_produced = produced + cur_cps * wait
+            new_cps = cur_cps + item_cps[idx]
+            expanded += 1
+            if new_produced + upper_bound(new_now, new_cookies, new_cps, new_counts) <= best_value:
+                continue
+            key = (new_counts, int(new_now / bucket))
+            if key in memo and memo[key] >= new_cookies:
+                continue
+            if key in memo or len(memo) < self._max_states:
+                memo[key] = new_cookies
+            path.append(idx)
+            stack.append([new_now, new_cookies, new_produced, new_cps, new_counts,
+                          children(new_now, new_cookies, new_cps, new_counts)])
+
+        # Replay the plan to record the CPS and time left expected
+        # before each purchase and after the last one
+        self._plan = [items[idx] for idx in best_path]
+        self._expected = []
+        self._step = 0
+        now = 0.0
+        counts = [0] * len(items)
+        for idx in best_path:
+            self._expected.append((cps, time_left - now))
+            cost = curves.get_cost_at(items[idx], counts[idx])
+            if cost > cookies:
+                wait = math.ceil((cost - cookies) / cps)
+                now += wait
+                cookies += cps * wait
+            cookies -= cost
+            cps += item_cps[idx]
+            counts[idx] += 1
+        self._expected.append((cps, time_left - now))
+        self._stats = {"expanded": expanded, "states": len(memo),
+                       "purchases": len(best_path), "cookies": best_value}
+
+
 def run_strategy(strategy_name, time, strategy):
     """
     Run a simulation with one strategy
     """
-    #state = simulate_clicker(provided.BuildInfo(), time, strategy)
-    state1 = simulate_clicker(provided.BuildInfo(), time, strategy_cheap)
-    print strategy_name, ":", state1
-    print state1.get_history()
-    print "#########"
-    state2 = simulate_clicker(provided.BuildInfo(), time, strategy_expensive)
-
-    print strategy_name, ":", state2
-    print state2.get_history()
-    print "#########"
-    state = simulate_clicker(provided.BuildInfo(), time, strategy_best)
+    state = simulate_clicker(provided.BuildInfo(), time, strategy)
     print strategy_name, ":", state
     print state.get_history()
 
@@ -227,20 +873,84 @@ def run_strategy(strategy_name, time, strategy):
     # Uncomment out the lines below to see a plot of total cookies vs. time
     # Be sure to allow popups, if you do want to see it
 
-    #history1 = state1.get_history()
-    # history1 = [(item[0], item[3]) for item in history1]
-    # history2 = state2.get_history()
-    # history2 = [(item[0], item[3]) for item in history2]
-    # simpleplot.plot_lines(strategy_name, 1000, 400, 'Time', 'Total Cookies', [history2], True)
+    # history = state.get_history()
+    # history = [(item[0], item[3]) for item in history]
+    # simpleplot.plot_lines(strategy_name, 1000, 400, 'Time', 'Total Cookies', [history], True)
+
+def run_sweep_task(task):
+    """
+    Run one simulation of a sweep, task is a tuple
+    (strategy label, strategy, build info label, build info, duration)
+    Returns a dictionary with the results and the wall time
+    """
+    import time
+    strategy_name, strategy, info_name, build_info, duration = task
+    start = time.time()
+    state = simulate_clicker(build_info, duration, strategy)
+    wall_time = time.time() - start
+    return {"strategy": strategy_name,
+            "build_info": info_name,
+            "duration": duration,
+            "total_cookies": state.get_total_cookies(),
+            "cps": state.get_cps(),
+            "purchases": len(state.get_history()) - 1,
+            "wall_time": wall_time}
+
+def sweep_strategies(strategies, durations, build_infos=None, processes=None):
+    """
+    Run every strategy for every duration and every build info on a
+    pool of worker processes.
+    strategies is a dictionary from a label to a strategy function
+    or PlannerStrategy, and build_infos is a dictionary from a label
+    to a BuildInfo object, by default the standard BuildInfo.
+    Prints and returns the table of results, one dictionary per
+    simulation, sorted by strategy label and build info label, then
+    in the order of durations
+    """
+    import multiprocessing
+    if build_infos == None:
+        build_infos = {"default": provided.BuildInfo()}
+    tasks = []
+    for strategy_name in sorted(strategies):
+        for info_name in sorted(build_infos):
+            for duration in durations:
+                tasks.append((strategy_name, strategies[strategy_name], info_name,
+                              build_infos[info_name], duration))
+    pool = multiprocessing.Pool(processes)
+    try:
+        table = pool.map(run_sweep_task, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    print_sweep_table(table)
+    return table
+
+def print_sweep_table(table):
+    """
+    Print the results of sweep_strategies as an aligned table
+    """
+    print "%-20s %-12s %10s %14s %12s %10s %10s" % ("strategy", "build_info", "duration",
+                                                   "total_cookies", "cps", "purchases", "wall_time")
+    for row in table:
+        print "%-20s %-12s %10.3g %14.6g %12.6g %10d %10.4f" % (row["strategy"], row["build_info"],
+                                                               row["duration"], row["total_cookies"],
+                                                               row["cps"], row["purchases"],
+                                                               row["wall_time"])
 
 def run():
     """
     Run the simulator.
     """  
-    run_strategy("Cursor", SIM_TIME, strategy_best)
+    run_strategy("Cheap", SIM_TIME, strategy_cheap)
+    print "#########"
+    run_strategy("Expensive", SIM_TIME, strategy_expensive)
+    print "#########"
+    run_strategy("Best", SIM_TIME, strategy_best)
 
     
     
 #run()
-
-
+#benchmark_simulate(strategy_cursor)
+#sweep_strategies({"Cursor": strategy_cursor, "Cheap": strategy_cheap, "Expensive": strategy_expensive,
+#                  "Best": strategy_best, "Planner": PlannerStrategy()}, [1e6, 1e8, SIM_TIME])
+#run_strategy("Planner", SIM_TIME, PlannerStrategy())
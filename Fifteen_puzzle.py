@@ -4,8 +4,24 @@ Note that solved configuration has the blank (zero) tile in upper left
 Use the arrows key to swap this tile with its neighbors
 """
 
+import time
+import random
 import poc_fifteen_gui
 
+# Only used by the solvers, and not available in CodeSkulptor
+try:
+    import array
+except ImportError:
+    array = None
+try:
+    import bisect
+except ImportError:
+    bisect = None
+try:
+    import copy
+except ImportError:
+    copy = None
+
 class Puzzle:
     """
     Class representation for the Fifteen puzzle
@@ -27,6 +43,12 @@ class Puzzle:
                 for col in range(puzzle_width):
                     self._grid[row][col] = initial_grid[row][col]
 
+        # Position of each value, kept up to date by every change
+        self._positions = {}
+        for row in range(puzzle_height):
+            for col in range(puzzle_width):
+                self._positions[self._grid[row][col]] = (row, col)
+
     def __str__(self):
         """
         Generate string representaion for puzzle
@@ -66,7 +88,11 @@ class Puzzle:
         """
         Setter for the number at tile position pos
         """
+        old_value = self._grid[row][col]
+        if self._positions.get(old_value) == (row, col):
+            del self._positions[old_value]
         self._grid[row][col] = value
+        self._positions[value] = (row, col)
 
     def clone(self):
         """
@@ -86,10 +112,14 @@ class Puzzle:
         Returns a tuple of two integers        
         """
         solved_value = (solved_col + self._width * solved_row)
+        if solved_value in self._positions:
+            return self._positions[solved_value]
 
+        # Only after set_number overwrote the value somewhere else
         for row in range(self._height):
             for col in range(self._width):
                 if self._grid[row][col] == solved_value:
+                    self._positions[solved_value] = (row, col)
                     return (row, col)
         assert False, "Value " + str(solved_value) + " not found"
 
@@ -97,30 +127,55 @@ class Puzzle:
         """
         Updates the puzzle state based on the provided move string
         """
+        positions = self._positions
         zero_row, zero_col = self.current_position(0, 0)
         for direction in move_string:
             if direction == "l":
                 assert zero_col > 0, "move off grid: " + direction
-                self._grid[zero_row][zero_col] = self._grid[zero_row][zero_col - 1]
+                tile = self._grid[zero_row][zero_col - 1]
+                self._grid[zero_row][zero_col] = tile
                 self._grid[zero_row][zero_col - 1] = 0
+                positions[tile] = (zero_row, zero_col)
                 zero_col -= 1
             elif direction == "r":
                 assert zero_col < self._width - 1, "move off grid: " + direction
-                self._grid[zero_row][zero_col] = self._grid[zero_row][zero_col + 1]
+                tile = self._grid[zero_row][zero_col + 1]
+                self._grid[zero_row][zero_col] = tile
                 self._grid[zero_row][zero_col + 1] = 0
+                positions[tile] = (zero_row, zero_col)
                 zero_col += 1
             elif direction == "u":
                 assert zero_row > 0, "move off grid: " + direction
-                self._grid[zero_row][zero_col] = self._grid[zero_row - 1][zero_col]
+                tile = self._grid[zero_row - 1][zero_col]
+                self._grid[zero_row][zero_col] = tile
                 self._grid[zero_row - 1][zero_col] = 0
+                positions[tile] = (zero_row, zero_col)
                 zero_row -= 1
             elif direction == "d":
                 assert zero_row < self._height - 1, "move off grid: " + direction
-                self._grid[zero_row][zero_col] = self._grid[zero_row + 1][zero_col]
+                tile = self._grid[zero_row + 1][zero_col]
+                self._grid[zero_row][zero_col] = tile
                 self._grid[zero_row + 1][zero_col] = 0
+                positions[tile] = (zero_row, zero_col)
                 zero_row += 1
             else:
                 assert False, "invalid direction: " + direction
+            positions[0] = (zero_row, zero_col)
+
+    def replay(self, move_string):
+        """
+        Updates the puzzle state like update_puzzle, for long move
+        strings known to be legal (such as solver output): moves are
+        not checked, and the grid and position index are rebuilt once
+        at the end
+        """
+        width = self._width
+        tiles = [value for row in self._grid for value in row]
+        replay_tiles(tiles, tiles.index(0), move_string, width)
+        self._grid = [tiles[row * width:(row + 1) * width] for row in range(self._height)]
+        self._positions = {}
+        for idx in range(len(tiles)):
+            self._positions[tiles[idx]] = (idx // width, idx % width)
 
     ##################################################################
     # Phase one methods
@@ -340,7 +395,8 @@ class Puzzle:
         Updates the puzzle and returns a move string
         """
         tmp = ""
-        string = ""
+        # Move strings of each step, joined once at the end
+        strings = []
         zero_pos = self.current_position(0,0)
         for dummy_row in range(zero_pos[0], self._height - 1):
             tmp += "d"
@@ -350,17 +406,1191 @@ class Puzzle:
         for row in range(self._height -1, 1, -1):
             for col in range(self._width -1, 0, -1):
                 assert self.lower_row_invariant(row,col)
-                string += self.solve_interior_tile(row, col)
+                strings.append(self.solve_interior_tile(row, col))
                 assert self.lower_row_invariant(row, col -1)
             self.lower_row_invariant(row, 0)
-            string += self.solve_col0_tile(row)
+            strings.append(self.solve_col0_tile(row))
         for col in range(self._width -1, 1, -1):
             assert self.row1_invariant(col)
-            string += self.solve_row1_tile(col)
+            strings.append(self.solve_row1_tile(col))
             assert self.row0_invariant(col)
-            string += self.solve_row0_tile(col)
-        string +=self.solve_2x2()
-        return tmp + string
+            strings.append(self.solve_row0_tile(col))
+        strings.append(self.solve_2x2())
+        return tmp + "".join(strings)
+
+    def is_solvable(self):
+        """
+        Check whether the puzzle can reach the solved configuration:
+        every move swaps the zero tile with a neighbor, so the parity
+        of the tile permutation must match the parity of the distance
+        of the zero tile from the upper left corner
+        Returns a boolean
+        """
+        values = [self._grid[row][col]
+                  for row in range(self._height) for col in range(self._width)]
+        seen = [False] * len(values)
+        swaps = 0
+        # A cycle of length n takes n - 1 swaps
+        for start in range(len(values)):
+            if seen[start]:
+                continue
+            idx = values[start]
+            seen[start] = True
+            while idx != start:
+                seen[idx] = True
+                idx = values[idx]
+                swaps += 1
+        zero_row, zero_col = self.current_position(0, 0)
+        return swaps % 2 == (zero_row + zero_col) % 2
+
+    def solve_optimal(self, solver=None):
+        """
+        Generate a shortest solution string with IDA*, unlike the
+        phase methods above; pass an IDAStarSolver to set a node or
+        time budget and read its stats
+        Updates the puzzle and returns a move string, or None if
+        the puzzle cannot be solved within the budget
+        """
+        if solver == None:
+            solver = IDAStarSolver()
+        string = solver.solve(self)
+        if string != None:
+            self.update_puzzle(string)
+        return string
+
+##################################################################
+# Optimal solver
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the node or time budget runs out
+    """
+    pass
+
+# Blank moves as (direction, row step, col step) and their inverses
+MOVES = [("u", -1, 0), ("l", 0, -1), ("r", 0, 1), ("d", 1, 0)]
+INVERSE = {"u": "d", "d": "u", "l": "r", "r": "l"}
+
+# Returned by IDAStarSolver.search when it reaches the solved puzzle
+FOUND = -1
+
+def line_conflict(goals):
+    """
+    Linear conflict of one row or column, given the goal positions
+    along the line of the tiles in it that belong to it, in order:
+    each tile that has to leave the line so the others can pass it
+    costs two extra moves
+    Returns an integer
+    """
+    tails = []
+    for goal in goals:
+        idx = bisect.bisect_left(tails, goal)
+        if idx == len(tails):
+            tails.append(goal)
+        else:
+            tails[idx] = goal
+    return 2 * (len(goals) - len(tails))
+
+class IDAStarSolver:
+    """
+    Iterative deepening A* solver for puzzles of any size, with the
+    Manhattan distance plus linear conflicts as heuristic, or the
+    pattern databases of a PatternHeuristic when one is given
+    The search stops after node_budget expanded nodes or time_budget
+    seconds when they are set
+    """
+
+    def __init__(self, node_budget=None, time_budget=None, patterns=None):
+        self._node_budget = node_budget
+        self._time_budget = time_budget
+        self._patterns = patterns
+        self._pattern_data = None
+        self._pattern_indices = []
+        self._tile_patterns = []
+        self._tile_weights = []
+        self._nodes = 0
+        self._elapsed = 0.0
+        self._bound = 0
+        self._deadline = None
+        self._width = 0
+        self._tiles = []
+        self._dist = []
+        self._neighbours = []
+        self._row_conflicts = []
+        self._col_conflicts = []
+        self._path = []
+
+    def get_stats(self):
+        """
+        Report on the last solve
+        Returns a dictionary with the expanded nodes, the seconds
+        taken and the last cost bound searched
+        """
+        return {"nodes": self._nodes, "seconds": self._elapsed, "bound": self._bound}
+
+    def row_conflict(self, row):
+        """
+        Linear conflict of a row of the current tiles
+        Returns an integer
+        """
+        width = self._width
+        return line_conflict([value % width
+                              for value in self._tiles[row * width:(row + 1) * width]
+                              if value != 0 and value // width == row])
+
+    def col_conflict(self, col):
+        """
+        Linear conflict of a column of the current tiles
+        Returns an integer
+        """
+        width = self._width
+        return line_conflict([value // width for value in self._tiles[col::width]
+                              if value != 0 and value % width == col])
+
+    def setup(self, puzzle):
+        """
+        Copy the puzzle into a flat list of tiles and build the
+        distance and neighbour tables
+        Returns the heuristic of the puzzle
+        """
+        height = puzzle.get_height()
+        width = puzzle.get_width()
+        size = height * width
+        self._width = width
+        self._tiles = [puzzle.get_number(idx // width, idx % width) for idx in range(size)]
+        self._dist = [[abs(value // width - idx // width) + abs(value % width - idx % width)
+                       for idx in range(size)] for value in range(size)]
+        self._neighbours = []
+        for idx in range(size):
+            neighbours = []
+            for direction, row_step, col_step in MOVES:
+                row = idx // width + row_step
+                col = idx % width + col_step
+                if 0 <= row < height and 0 <= col < width:
+                    neighbours.append((direction, row * width + col))
+            self._neighbours.append(neighbours)
+        self._path = []
+        if self._patterns != None:
+            return self.setup_patterns()
+        self._row_conflicts = [self.row_conflict(row) for row in range(height)]
+        self._col_conflicts = [self.col_conflict(col) for col in range(width)]
+        manhattan = sum([self._dist[self._tiles[idx]][idx]
+                         for idx in range(size) if self._tiles[idx] != 0])
+        return manhattan + sum(self._row_conflicts) + sum(self._col_conflicts)
+
+    def setup_patterns(self):
+        """
+        Find the database index of each pattern and the pattern and
+        index weight of each tile
+        Returns the heuristic of the tiles
+        """
+        size = len(self._tiles)
+        assert (self._patterns.get_height() * self._patterns.get_width() == size and
+                self._patterns.get_width() == self._width), "pattern databases of another size"
+        positions = [0] * size
+        for idx in range(size):
+            positions[self._tiles[idx]] = idx
+        databases = self._patterns.get_databases()
+        self._pattern_data = [database.get_data() for database in databases]
+        self._pattern_indices = [database.index(positions) for database in databases]
+        self._tile_patterns = [None] * size
+        self._tile_weights = [0] * size
+        for number in range(len(databases)):
+            pattern = databases[number].get_pattern()
+            for slot in range(len(pattern)):
+                self._tile_patterns[pattern[slot]] = number
+                self._tile_weights[pattern[slot]] = databases[number].get_weights()[slot]
+        return sum([databases[number].lookup(self._pattern_indices[number])
+                    for number in range(len(databases))])
+
+    def search(self, blank, cost, bound, heuristic, last):
+        """
+        Depth first search below the blank at index blank, cutting
+        off when cost plus heuristic is over bound
+        Returns FOUND with the moves in the path, or the smallest
+        cost plus heuristic over the bound
+        """
+        total = cost + heuristic
+        if total > bound:
+            return total
+        if heuristic == 0:
+            return FOUND
+        self._nodes += 1
+        if self._node_budget != None and self._nodes > self._node_budget:
+            raise SearchTimeout()
+        if self._deadline != None and self._nodes % 1024 == 0 and time.time() > self._deadline:
+            raise SearchTimeout()
+        tiles = self._tiles
+        pattern_data = self._pattern_data
+        indices = self._pattern_indices
+        best = None
+        for direction, target in self._neighbours[blank]:
+            if direction == INVERSE.get(last):
+                continue
+            tile = tiles[target]
+            tiles[blank] = tile
+            tiles[target] = 0
+            if pattern_data != None:
+                # Only the pattern of the tile changes index
+                pattern = self._tile_patterns[tile]
+                data = pattern_data[pattern]
+                old_index = indices[pattern]
+                new_index = old_index + (blank - target) * self._tile_weights[tile]
+                indices[pattern] = new_index
+                delta = ord(data[new_index:new_index + 1]) - ord(data[old_index:old_index + 1])
+            else:
+                delta = self._dist[tile][blank] - self._dist[tile][target]
+                conflicts, first, second, old_first, old_second = \
+                    self.update_conflicts(direction, blank, target)
+                delta += conflicts[first] + conflicts[second] - old_first - old_second
+            self._path.append(direction)
+            result = self.search(target, cost + 1, bound, heuristic + delta, direction)
+            if result == FOUND:
+                return FOUND
+            self._path.pop()
+            if pattern_data != None:
+                indices[pattern] = old_index
+            else:
+                conflicts[first], conflicts[second] = old_first, old_second
+            tiles[target] = tile
+            tiles[blank] = 0
+            if best == None or result < best:
+                best = result
+        return best
+
+    def update_conflicts(self, direction, blank, target):
+        """
+        Recompute the conflicts after a tile moved from target to
+        blank; only the two lines it moved between can change
+        Returns the list of row or column conflicts, the two lines
+        and their old conflicts
+        """
+        width = self._width
+        if direction == "l" or direction == "r":
+            conflicts = self._col_conflicts
+            first, second = blank % width, target % width
+            new_first, new_second = self.col_conflict(first), self.col_conflict(second)
+        else:
+            conflicts = self._row_conflicts
+            first, second = blank // width, target // width
+            new_first, new_second = self.row_conflict(first), self.row_conflict(second)
+        old_first, old_second = conflicts[first], conflicts[second]
+        conflicts[first], conflicts[second] = new_first, new_second
+        return conflicts, first, second, old_first, old_second
+
+    def solve(self, puzzle):
+        """
+        Find a shortest solution of the puzzle, which is not changed
+        Returns a move string, or None if the puzzle cannot be solved
+        or the budget ran out
+        """
+        start = time.time()
+        self._nodes = 0
+        self._deadline = None
+        if self._time_budget != None:
+            self._deadline = start + self._time_budget
+        solution = None
+        if puzzle.is_solvable():
+            heuristic = self.setup(puzzle)
+            blank = self._tiles.index(0)
+            bound = heuristic
+            try:
+                while True:
+                    self._bound = bound
+                    result = self.search(blank, 0, bound, heuristic, None)
+                    if result == FOUND:
+                        solution = "".join(self._path)
+                        break
+                    bound = result
+            except SearchTimeout:
+                pass
+        self._elapsed = time.time() - start
+        return solution
+
+##################################################################
+# Flat puzzle state for search
+
+MASK64 = (1 << 64) - 1
+
+def zobrist_key(key):
+    """
+    Zobrist key of a tile value at a flat index, given key = value *
+    size + index, mixed with the splitmix64 finalizer instead of
+    stored in a table, so any puzzle size works and every process
+    gets the same keys; 61 bits so that Python 3 uses the XOR of
+    keys as the hash unchanged
+    Returns a 61 bit integer
+    """
+    key = (key * 0x9E3779B97F4A7C15 + 0x9E3779B97F4A7C15) & MASK64
+    key = ((key ^ (key >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    key = ((key ^ (key >> 27)) * 0x94D049BB133111EB) & MASK64
+    return (key ^ (key >> 31)) >> 3
+
+def tile_typecode(size):
+    """
+    Smallest array typecode holding the values of size tiles
+    Returns a string
+    """
+    if size <= 1 << 8:
+        return "B"
+    if size <= 1 << 16:
+        return "H"
+    return "L"
+
+class FlatPuzzle:
+    """
+    Puzzle stored as one flat array of tiles, row by row, with the
+    index of the zero tile and a Zobrist hash kept up to date by every
+    move; clones copy the array in one go
+    Same GUI and core methods as Puzzle
+    """
+
+    def __init__(self, puzzle_height, puzzle_width, initial_grid=None):
+        """
+        Initialize puzzle with default height and width
+        Returns a FlatPuzzle object
+        """
+        self._height = puzzle_height
+        self._width = puzzle_width
+        size = puzzle_height * puzzle_width
+        self._tiles = array.array(tile_typecode(size), range(size))
+        if initial_grid != None:
+            for row in range(puzzle_height):
+                for col in range(puzzle_width):
+                    self._tiles[row * puzzle_width + col] = initial_grid[row][col]
+        self._blank = self._tiles.index(0)
+        self._hash = 0
+        for idx in range(size):
+            self._hash ^= zobrist_key(self._tiles[idx] * size + idx)
+
+    def __str__(self):
+        """
+        Generate string representaion for puzzle
+        Returns a string
+        """
+        ans = ""
+        for row in range(self._height):
+            ans += str(list(self._tiles[row * self._width:(row + 1) * self._width]))
+            ans += "\n"
+        return ans
+
+    def get_height(self):
+        """
+        Getter for puzzle height
+        Returns an integer
+        """
+        return self._height
+
+    def get_width(self):
+        """
+        Getter for puzzle width
+        Returns an integer
+        """
+        return self._width
+
+    def get_number(self, row, col):
+        """
+        Getter for the number at tile position pos
+        Returns an integer
+        """
+        return self._tiles[row * self._width + col]
+
+    def set_number(self, row, col, value):
+        """
+        Setter for the number at tile position pos
+        """
+        size = len(self._tiles)
+        idx = row * self._width + col
+        self._hash ^= zobrist_key(self._tiles[idx] * size + idx)
+        self._tiles[idx] = value
+        self._hash ^= zobrist_key(value * size + idx)
+        if value == 0:
+            self._blank = idx
+        elif self._blank == idx:
+            self._blank = self._tiles.index(0) if 0 in self._tiles else None
+
+    def clone(self):
+        """
+        Make a copy of the puzzle to update during solving
+        Returns a FlatPuzzle object
+        """
+        new_puzzle = copy.copy(self)
+        new_puzzle._tiles = self._tiles[:]
+        return new_puzzle
+
+    def get_hash(self):
+        """
+        Getter for the Zobrist hash of the tiles
+        Returns an integer
+        """
+        return self._hash
+
+    def snapshot(self):
+        """
+        Freeze the tiles for visited sets and transposition tables
+        Returns a PuzzleSnapshot object
+        """
+        return PuzzleSnapshot(self._height, self._width, tuple(self._tiles), self._hash)
+
+    def to_puzzle(self):
+        """
+        Copy the tiles into a Puzzle, for the phase solver
+        Returns a Puzzle object
+        """
+        return Puzzle(self._height, self._width,
+                      [[self.get_number(row, col) for col in range(self._width)]
+                       for row in range(self._height)])
+
+    def current_position(self, solved_row, solved_col):
+        """
+        Locate the current position of the tile that will be at
+        position (solved_row, solved_col) when the puzzle is solved
+        Returns a tuple of two integers
+        """
+        solved_value = solved_col + self._width * solved_row
+        if solved_value == 0 and self._blank != None:
+            idx = self._blank
+        else:
+            assert solved_value in self._tiles, "Value " + str(solved_value) + " not found"
+            idx = self._tiles.index(solved_value)
+        return (idx // self._width, idx % self._width)
+
+    def move_blank(self, target):
+        """
+        Swap the zero tile with the tile at flat index target, which
+        must be next to it
+        """
+        tiles = self._tiles
+        size = len(tiles)
+        blank = self._blank
+        tile = tiles[target]
+        tiles[blank] = tile
+        tiles[target] = 0
+        self._hash ^= (zobrist_key(tile * size + target) ^ zobrist_key(tile * size + blank) ^
+                       zobrist_key(blank) ^ zobrist_key(target))
+        self._blank = target
+
+    def update_puzzle(self, move_string):
+        """
+        Updates the puzzle state based on the provided move string
+        """
+        width = self._width
+        zero_row, zero_col = self.current_position(0, 0)
+        for direction in move_string:
+            if direction == "l":
+                assert zero_col > 0, "move off grid: " + direction
+                zero_col -= 1
+            elif direction == "r":
+                assert zero_col < width - 1, "move off grid: " + direction
+                zero_col += 1
+            elif direction == "u":
+                assert zero_row > 0, "move off grid: " + direction
+                zero_row -= 1
+            elif direction == "d":
+                assert zero_row < self._height - 1, "move off grid: " + direction
+                zero_row += 1
+            else:
+                assert False, "invalid direction: " + direction
+            self.move_blank(zero_row * width + zero_col)
+
+    def replay(self, move_string):
+        """
+        Updates the puzzle state like update_puzzle, for long move
+        strings known to be legal: moves are not checked and the hash
+        is recomputed once at the end
+        """
+        tiles = self._tiles
+        size = len(tiles)
+        self._blank = replay_tiles(tiles, self._blank, move_string, self._width)
+        self._hash = 0
+        for idx in range(size):
+            self._hash ^= zobrist_key(tiles[idx] * size + idx)
+
+    def is_solvable(self):
+        """
+        Check whether the puzzle can reach the solved configuration
+        Returns a boolean
+        """
+        return self.to_puzzle().is_solvable()
+
+    def solve_puzzle(self):
+        """
+        Generate a solution string with the phase solver of Puzzle
+        Updates the puzzle and returns a move string
+        """
+        string = self.to_puzzle().solve_puzzle()
+        self.update_puzzle(string)
+        return string
+
+class PuzzleSnapshot:
+    """
+    Immutable copy of the tiles of a FlatPuzzle that hashes to its
+    Zobrist hash
+    """
+
+    def __init__(self, puzzle_height, puzzle_width, tiles, zobrist_hash):
+        self._height = puzzle_height
+        self._width = puzzle_width
+        self._tiles = tiles
+        self._hash = zobrist_hash
+
+    def __hash__(self):
+        """
+        Hash for sets and dictionaries: the Zobrist hash of the tiles
+        """
+        return self._hash
+
+    def __eq__(self, other):
+        """
+        Snapshots are equal when they have the same tiles in the
+        same shape
+        """
+        return (isinstance(other, PuzzleSnapshot) and self._width == other.get_width() and
+                self._tiles == other.get_tiles())
+
+    def __ne__(self, other):
+        """
+        Opposite of __eq__, which Python 2 does not derive
+        """
+        return not self == other
+
+    def get_height(self):
+        """
+        Getter for puzzle height
+        Returns an integer
+        """
+        return self._height
+
+    def get_width(self):
+        """
+        Getter for puzzle width
+        Returns an integer
+        """
+        return self._width
+
+    def get_number(self, row, col):
+        """
+        Getter for the number at tile position pos
+        Returns an integer
+        """
+        return self._tiles[row * self._width + col]
+
+    def get_tiles(self):
+        """
+        Getter for the tiles row by row
+        Returns a tuple of integers
+        """
+        return self._tiles
+
+    def thaw(self):
+        """
+        Make a puzzle to update from the snapshot
+        Returns a FlatPuzzle object
+        """
+        return FlatPuzzle(self._height, self._width,
+                          [self._tiles[row * self._width:(row + 1) * self._width]
+                           for row in range(self._height)])
+
+##################################################################
+# Move strings
+
+# Closed loops of the zero tile around a 2x2 block: each one rotates
+# the three tiles of the block, so three in a row change nothing
+SQUARE_LOOPS = ["drul", "dlur", "urdl", "uldr", "rdlu", "ruld", "ldru", "lurd"]
+SQUARE_LOOP_RUNS = "(" + "|".join(SQUARE_LOOPS) + r")\1+"
+
+def invert_moves(move_string):
+    """
+    Moves that undo move_string
+    Returns a string
+    """
+    return "".join([INVERSE[direction] for direction in reversed(move_string)])
+
+def cancel_inverse_moves(move_string):
+    """
+    Drop every move that is undone by the next one, like "lr" or
+    "ud", including the pairs that meet once the inner ones are gone
+    Returns a string
+    """
+    kept = []
+    for direction in move_string:
+        if kept and kept[-1] == INVERSE[direction]:
+            kept.pop()
+        else:
+            kept.append(direction)
+    return "".join(kept)
+
+def shorten_square_loop(match):
+    """
+    Replacement for a run of one square loop: the repeats modulo
+    three, with two repeats written as one loop the other way
+    Returns a string
+    """
+    loop = match.group(1)
+    repeats = (len(match.group(0)) // len(loop)) % 3
+    if repeats == 2:
+        return invert_moves(loop)
+    return loop * repeats
+
+def compress_moves(move_string):
+    """
+    Shorten a move string without changing the puzzle it leads to,
+    by cancelling inverse moves and shortening repeated square loops
+    Returns a string
+    """
+    import re
+    while True:
+        shorter = re.sub(SQUARE_LOOP_RUNS, shorten_square_loop,
+                         cancel_inverse_moves(move_string))
+        if len(shorter) == len(move_string):
+            return shorter
+        move_string = shorter
+
+def replay_tiles(tiles, blank, move_string, width):
+    """
+    Play the moves on a flat list or array of tiles with the zero
+    tile at index blank; moves are not checked, and the zero tile is
+    only written where it ends up
+    Returns the final index of the zero tile
+    """
+    steps = {"l": -1, "r": 1, "u": -width, "d": width}
+    for direction in move_string:
+        target = blank + steps[direction]
+        tiles[blank] = tiles[target]
+        blank = target
+    tiles[blank] = 0
+    return blank
+
+##################################################################
+# Pattern databases
+
+# Disjoint patterns by puzzle size: the tiles are split between them
+# and their database values add up to an admissible heuristic
+DEFAULT_PATTERNS = {(3, 3): [[1, 2, 3, 4], [5, 6, 7, 8]],
+                    (4, 4): [[1, 4, 5, 8, 9, 12], [2, 3, 6, 7, 10, 11], [13, 14, 15]]}
+
+# Database byte of the placements no search reached
+PATTERN_UNSEEN = 255
+
+def pattern_path(directory, puzzle_height, puzzle_width, pattern):
+    """
+    File name of the database of a pattern
+    Returns a string
+    """
+    import os
+    return os.path.join(directory, "pdb_" + str(puzzle_height) + "x" + str(puzzle_width) +
+                        "_" + "-".join([str(tile) for tile in pattern]) + ".bin")
+
+def build_pattern_database(task):
+    """
+    Breadth first search from the solved puzzle over the squares of
+    the tiles of one pattern, counting only the moves of those tiles:
+    the zero tile moves freely through the other squares, so a state
+    is the pattern tiles plus the region of free squares the zero
+    tile is in, named by its lowest square
+    task is a tuple (height, width, pattern, path); the distance of
+    each placement is written to path as one byte at index
+    sum(square * size ** slot) over the slots of the pattern
+    Returns a tuple of the path and the largest distance
+    """
+    puzzle_height, puzzle_width, pattern, path = task
+    size = puzzle_height * puzzle_width
+    slots = len(pattern)
+    assert size ** (slots + 1) < 1 << 32, "pattern too large: " + str(pattern)
+    neighbours = [[] for dummy_square in range(size)]
+    for square in range(size):
+        for dummy_direction, row_step, col_step in MOVES:
+            row = square // puzzle_width + row_step
+            col = square % puzzle_width + col_step
+            if 0 <= row < puzzle_height and 0 <= col < puzzle_width:
+                neighbours[square].append(row * puzzle_width + col)
+    weights = [size ** slot for slot in range(slots)]
+
+    def region(start, occupied):
+        """
+        Bitmask of the free squares reachable from square start
+        """
+        mask = 1 << start
+        stack = [start]
+        while stack:
+            for neighbour in neighbours[stack.pop()]:
+                bit = 1 << neighbour
+                if not (occupied | mask) & bit:
+                    mask |= bit
+                    stack.append(neighbour)
+        return mask
+
+    def lowest(mask):
+        """
+        Lowest square of a bitmask
+        """
+        return (mask & -mask).bit_length() - 1
+
+    distances = bytearray([PATTERN_UNSEEN]) * (size ** slots)
+    visited = bytearray(size ** (slots + 1) // 8 + 1)
+    start_index = sum([pattern[slot] * weights[slot] for slot in range(slots)])
+    start_occupied = sum([1 << tile for tile in pattern])
+    start_code = start_index * size + lowest(region(0, start_occupied))
+    visited[start_code >> 3] |= 1 << (start_code & 7)
+    distances[start_index] = 0
+    frontier = array.array("L", [start_code])
+    depth = 0
+    while frontier:
+        next_frontier = array.array("L")
+        for code in frontier:
+            index, free_square = divmod(code, size)
+            owners = {}
+            occupied = 0
+            remainder = index
+            for slot in range(slots):
+                remainder, square = divmod(remainder, size)
+                owners[square] = slot
+                occupied |= 1 << square
+            free = region(free_square, occupied)
+            while free:
+                square = lowest(free)
+                free &= free - 1
+                for neighbour in neighbours[square]:
+                    if neighbour not in owners:
+                        continue
+                    # Move the pattern tile on neighbour into square
+                    new_index = index + (square - neighbour) * weights[owners[neighbour]]
+                    new_occupied = occupied ^ (1 << square) ^ (1 << neighbour)
+                    new_code = new_index * size + lowest(region(neighbour, new_occupied))
+                    if visited[new_code >> 3] & (1 << (new_code & 7)):
+                        continue
+                    visited[new_code >> 3] |= 1 << (new_code & 7)
+                    next_frontier.append(new_code)
+                    if distances[new_index] == PATTERN_UNSEEN:
+                        distances[new_index] = depth + 1
+        frontier = next_frontier
+        depth += 1
+    assert depth <= PATTERN_UNSEEN, "distances do not fit in a byte"
+    database_file = open(path, "wb")
+    database_file.write(distances)
+    database_file.close()
+    return path, depth - 1
+
+def build_pattern_databases(puzzle_height, puzzle_width, patterns=None, directory=".",
+                            processes=None):
+    """
+    Build the databases of the patterns (DEFAULT_PATTERNS for the
+    size when not given) that are not in directory yet, one per
+    worker process
+    Returns a list of (path, largest distance) tuples
+    """
+    import os
+    import multiprocessing
+    if patterns == None:
+        patterns = DEFAULT_PATTERNS[(puzzle_height, puzzle_width)]
+    tasks = []
+    for pattern in patterns:
+        path = pattern_path(directory, puzzle_height, puzzle_width, pattern)
+        if not os.path.exists(path):
+            tasks.append((puzzle_height, puzzle_width, list(pattern), path))
+    if len(tasks) < 2 or processes == 1:
+        return [build_pattern_database(task) for task in tasks]
+    pool = multiprocessing.Pool(min(processes or len(tasks), len(tasks)))
+    try:
+        return pool.map(build_pattern_database, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+class PatternDatabase:
+    """
+    Read only view of a database file written by
+    build_pattern_database, memory mapped on first use
+    """
+
+    def __init__(self, puzzle_height, puzzle_width, pattern, path):
+        self._size = puzzle_height * puzzle_width
+        self._pattern = list(pattern)
+        self._path = path
+        self._weights = [self._size ** slot for slot in range(len(pattern))]
+        self._file = None
+        self._data = None
+
+    def get_pattern(self):
+        """
+        Getter for the tiles of the pattern
+        Returns a list of integers
+        """
+        return self._pattern
+
+    def get_weights(self):
+        """
+        Getter for the index weight of each tile of the pattern
+        Returns a list of integers
+        """
+        return self._weights
+
+    def get_data(self):
+        """
+        Map the file into memory the first time it is needed
+        Returns an mmap object
+        """
+        if self._data == None:
+            import mmap
+            self._file = open(self._path, "rb")
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            assert len(self._data) == self._size ** len(self._pattern), \
+                "not a pattern database: " + self._path
+        return self._data
+
+    def close(self):
+        """
+        Release the file
+        """
+        if self._data != None:
+            self._data.close()
+            self._file.close()
+            self._data = None
+
+    def index(self, positions):
+        """
+        Database index of the pattern tiles, given the flat index
+        of every value
+        Returns an integer
+        """
+        return sum([positions[self._pattern[slot]] * self._weights[slot]
+                    for slot in range(len(self._pattern))])
+
+    def lookup(self, index):
+        """
+        Distance stored at a database index
+        Returns an integer
+        """
+        return ord(self.get_data()[index:index + 1])
+
+class PatternHeuristic:
+    """
+    Sum of disjoint pattern databases covering every tile of one
+    puzzle size
+    """
+
+    def __init__(self, puzzle_height, puzzle_width, patterns=None, directory="."):
+        if patterns == None:
+            patterns = DEFAULT_PATTERNS[(puzzle_height, puzzle_width)]
+        tiles = sorted([tile for pattern in patterns for tile in pattern])
+        assert tiles == list(range(1, puzzle_height * puzzle_width)), \
+            "patterns must split the tiles between them"
+        self._height = puzzle_height
+        self._width = puzzle_width
+        self._databases = [PatternDatabase(puzzle_height, puzzle_width, pattern,
+                                           pattern_path(directory, puzzle_height,
+                                                        puzzle_width, pattern))
+                           for pattern in patterns]
+
+    def get_height(self):
+        """
+        Getter for puzzle height
+        Returns an integer
+        """
+        return self._height
+
+    def get_width(self):
+        """
+        Getter for puzzle width
+        Returns an integer
+        """
+        return self._width
+
+    def get_databases(self):
+        """
+        Getter for the databases of the patterns
+        Returns a list of PatternDatabase objects
+        """
+        return self._databases
+
+    def close(self):
+        """
+        Release the files
+        """
+        for database in self._databases:
+            database.close()
+
+    def estimate(self, puzzle):
+        """
+        Lower bound on the moves to solve a puzzle of this size
+        Returns an integer
+        """
+        positions = [0] * (self._height * self._width)
+        for row in range(self._height):
+            for col in range(self._width):
+                positions[puzzle.get_number(row, col)] = row * self._width + col
+        return sum([database.lookup(database.index(positions))
+                    for database in self._databases])
+
+def load_pattern_heuristic(puzzle_height, puzzle_width, patterns=None, directory="."):
+    """
+    Returns the PatternHeuristic of the patterns (DEFAULT_PATTERNS
+    for the size when not given), or None if a database file is
+    missing from directory
+    """
+    heuristic = PatternHeuristic(puzzle_height, puzzle_width, patterns, directory)
+    for database in heuristic.get_databases():
+        try:
+            database.get_data()
+        except (IOError, OSError):
+            heuristic.close()
+            return None
+    return heuristic
+
+##################################################################
+# Batch solver
+
+BATCH_METHODS = ["phase", "compressed", "optimal"]
+
+# Pattern heuristic of each worker process by puzzle size, loaded on
+# first use
+BATCH_PATTERNS = {}
+
+def parse_grid(line):
+    """
+    Read one puzzle from a line, either as a list of rows like
+    [[1, 2], [0, 3]] or as rows separated by "/" with the tiles
+    separated by spaces or commas, like 1 2 / 0 3; the tiles must be
+    0 to height * width - 1, each once
+    Returns a list of lists of integers
+    """
+    text = line.strip()
+    if text.startswith("["):
+        # One row per inner list
+        text = text[1:-1].replace("]", "/").replace("[", "")
+    grid = [[int(tile) for tile in row.replace(",", " ").split()]
+            for row in text.split("/") if row.replace(",", " ").strip()]
+    assert grid and all([len(row) == len(grid[0]) for row in grid]), \
+        "not a grid: " + line.strip()
+    assert sorted(sum(grid, [])) == list(range(len(grid) * len(grid[0]))), \
+        "tiles are not 0 to " + str(len(grid) * len(grid[0]) - 1) + ": " + line.strip()
+    return grid
+
+def read_batch(input_path):
+    """
+    Read the puzzles of a batch file, one per line, skipping blank
+    lines and lines starting with #
+    Returns a generator of (instance number, line) tuples, parsed
+    by the workers so one bad line only fails its own instance
+    """
+    batch_file = open(input_path)
+    try:
+        number = 0
+        for line in batch_file:
+            if line.strip() and not line.lstrip().startswith("#"):
+                yield number, line
+                number += 1
+    finally:
+        batch_file.close()
+
+def solve_batch_task(task):
+    """
+    Solve one puzzle of a batch
+    task is a tuple (instance number, line, method, node budget,
+    time budget, pattern directory); the optimal method uses the
+    pattern databases in the directory when it is not None and they
+    exist, and falls back to the phase solver when the budget runs out
+    Returns a dictionary with the number, the grid, the status
+    (solved, unsolvable or invalid, with the error for invalid
+    lines), the moves (None unless solved), the method used and the
+    seconds taken
+    """
+    number, line, method, node_budget, time_budget, pattern_directory = task
+    start = time.time()
+    try:
+        grid = parse_grid(line)
+    except (AssertionError, ValueError) as error:
+        return {"number": number, "grid": None, "status": "invalid", "error": str(error),
+                "moves": None, "method": method, "seconds": time.time() - start}
+    puzzle = Puzzle(len(grid), len(grid[0]), grid)
+    moves = None
+    status = "unsolvable"
+    if puzzle.is_solvable():
+        status = "solved"
+        if method == "optimal":
+            size = (puzzle.get_height(), puzzle.get_width())
+            if pattern_directory != None and size not in BATCH_PATTERNS:
+                BATCH_PATTERNS[size] = None
+                if size in DEFAULT_PATTERNS:
+                    BATCH_PATTERNS[size] = load_pattern_heuristic(size[0], size[1], None,
+                                                                  pattern_directory)
+            solver = IDAStarSolver(node_budget, time_budget, BATCH_PATTERNS.get(size))
+            moves = solver.solve(puzzle)
+            if moves == None:
+                method = "phase"
+        if method != "optimal":
+            moves = puzzle.solve_puzzle()
+        if method == "compressed":
+            moves = compress_moves(moves)
+    return {"number": number, "grid": grid, "status": status, "moves": moves,
+            "method": method, "seconds": time.time() - start}
+
+def verify_solution(grid, moves):
+    """
+    Check that the moves solve the puzzle by replaying them with
+    update_puzzle
+    Returns a boolean
+    """
+    puzzle = Puzzle(len(grid), len(grid[0]), grid)
+    try:
+        puzzle.update_puzzle(moves)
+    except AssertionError:
+        return False
+    return str(puzzle) == str(Puzzle(len(grid), len(grid[0])))
+
+def solve_batch(input_path, output_path=None, method="phase", processes=None,
+                node_budget=None, time_budget=10.0, pattern_directory=None):
+    """
+    Solve every puzzle of a batch file on a pool of worker processes.
+    Results come back in input order: each one is verified, printed
+    with its solve time and move count, and its moves are written to
+    output_path, one line per puzzle with - for unsolvable ones and
+    invalid for lines that are not a puzzle.
+    Returns a dictionary with the puzzles solved, verified, unsolvable
+    and invalid, the total moves and the puzzles per second.
+    """
+    import multiprocessing
+    assert method in BATCH_METHODS, "unknown method " + method
+    tasks = ((number, line, method, node_budget, time_budget, pattern_directory)
+             for number, line in read_batch(input_path))
+    summary = {"puzzles": 0, "verified": 0, "unsolvable": 0, "invalid": 0, "moves": 0}
+    pool = multiprocessing.Pool(processes)
+    output = None
+    if output_path != None:
+        output = open(output_path, "w")
+    start = time.time()
+    try:
+        for result in pool.imap(solve_batch_task, tasks):
+            summary["puzzles"] += 1
+            moves = result["moves"]
+            line = str(result["number"]) + ": "
+            if result["status"] == "invalid":
+                summary["invalid"] += 1
+                line += "invalid, " + result["error"]
+                moves = "invalid"
+            elif result["status"] == "unsolvable":
+                summary["unsolvable"] += 1
+                line += "unsolvable"
+                moves = "-"
+            else:
+                verified = verify_solution(result["grid"], moves)
+                summary["verified"] += verified
+                summary["moves"] += len(moves)
+                line += (str(len(moves)) + " moves (" + result["method"] + ") in " +
+                         str(round(result["seconds"], 3)) + " s")
+                if not verified:
+                    line += ", FAILED verification"
+            print(line)
+            if output != None:
+                output.write(moves + "\n")
+                output.flush()
+    finally:
+        if output != None:
+            output.close()
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+    summary["puzzles_per_second"] = summary["puzzles"] / max(elapsed, 1e-9)
+    print(str(summary["puzzles"]) + " puzzles in " + str(round(elapsed, 3)) + " s, " +
+          str(round(summary["puzzles_per_second"], 1)) + " puzzles/s, " +
+          str(summary["verified"]) + " verified, " + str(summary["unsolvable"]) +
+          " unsolvable, " + str(summary["invalid"]) + " invalid, " +
+          str(summary["moves"]) + " moves")
+    return summary
+
+def write_batch(output_path, count, puzzle_height, puzzle_width, seed=0):
+    """
+    Write a batch file of count random solvable puzzles
+    """
+    rng = random.Random(seed)
+    batch_file = open(output_path, "w")
+    for dummy_idx in range(count):
+        puzzle = random_puzzle(puzzle_height, puzzle_width, rng)
+        batch_file.write(" / ".join([" ".join([str(puzzle.get_number(row, col))
+                                               for col in range(puzzle_width)])
+                                     for row in range(puzzle_height)]) + "\n")
+    batch_file.close()
+
+##################################################################
+# Benchmarks
+
+def random_puzzle(puzzle_height, puzzle_width, rng=random):
+    """
+    Make a uniformly random solvable puzzle
+    Returns a Puzzle object
+    """
+    values = list(range(puzzle_height * puzzle_width))
+    rng.shuffle(values)
+    grid = [values[row * puzzle_width:(row + 1) * puzzle_width]
+            for row in range(puzzle_height)]
+    puzzle = Puzzle(puzzle_height, puzzle_width, grid)
+    if not puzzle.is_solvable():
+        # Swapping two tiles other than zero flips the parity
+        tiles = [(row, col) for row in range(puzzle_height)
+                 for col in range(puzzle_width) if grid[row][col] != 0]
+        first_value = puzzle.get_number(tiles[0][0], tiles[0][1])
+        puzzle.set_number(tiles[0][0], tiles[0][1], puzzle.get_number(tiles[1][0], tiles[1][1]))
+        puzzle.set_number(tiles[1][0], tiles[1][1], first_value)
+    return puzzle
+
+def benchmark_solve(sizes=(4, 8, 16, 24, 32), seed=0):
+    """
+    Time solve_puzzle on a random square puzzle of each size and
+    print the seconds taken, the moves made and the moves per second
+    """
+    rng = random.Random(seed)
+    for size in sizes:
+        puzzle = random_puzzle(size, size, rng)
+        start = time.time()
+        moves = puzzle.solve_puzzle()
+        elapsed = time.time() - start
+        print(str(size) + "x" + str(size) + ": " + str(round(elapsed, 3)) + " s, " +
+              str(len(moves)) + " moves, " +
+              str(int(len(moves) / max(elapsed, 1e-9))) + " moves/s")
+
+def benchmark_clone(size=4, count=100000, seed=0):
+    """
+    Time count clones and hashes of a random size x size puzzle as a
+    Puzzle and as a FlatPuzzle and print the clones per second
+    """
+    puzzle = random_puzzle(size, size, random.Random(seed))
+    flat = FlatPuzzle(size, size, [[puzzle.get_number(row, col) for col in range(size)]
+                                   for row in range(size)])
+    start = time.time()
+    for dummy_idx in range(count):
+        hash(str(puzzle.clone()))
+    puzzle_time = time.time() - start
+    start = time.time()
+    for dummy_idx in range(count):
+        hash(flat.clone().snapshot())
+    flat_time = time.time() - start
+    print(str(size) + "x" + str(size) + ": Puzzle " +
+          str(int(count / max(puzzle_time, 1e-9))) + " clones/s, FlatPuzzle " +
+          str(int(count / max(flat_time, 1e-9))) + " clones/s")
+
+def benchmark_moves(sizes=(8, 16, 32, 64), seed=0):
+    """
+    For a random square puzzle of each size, print the length of the
+    solve_puzzle solution before and after compress_moves, and the
+    time to compress it and to play it with update_puzzle and replay
+    """
+    rng = random.Random(seed)
+    for size in sizes:
+        puzzle = random_puzzle(size, size, rng)
+        moves = puzzle.clone().solve_puzzle()
+        start = time.time()
+        compressed = compress_moves(moves)
+        compress_time = time.time() - start
+        start = time.time()
+        puzzle.clone().update_puzzle(moves)
+        update_time = time.time() - start
+        start = time.time()
+        puzzle.clone().replay(moves)
+        replay_time = time.time() - start
+        print(str(size) + "x" + str(size) + ": " + str(len(moves)) + " moves, " +
+              str(len(compressed)) + " compressed in " + str(round(compress_time, 3)) +
+              " s, update_puzzle " + str(round(update_time, 3)) + " s, replay " +
+              str(round(replay_time, 3)) + " s")
 
 # Start interactive simulation
 #poc_fifteen_gui.FifteenGUI(Puzzle(2, 2))
@@ -390,6 +1620,14 @@ class Puzzle:
 #obj = Puzzle(3, 3, [[8, 7, 6], [5, 4, 3], [2, 1, 0]])
 #print obj
 #print obj.solve_puzzle()
+#print obj.solve_optimal()
+#benchmark_solve()
+#benchmark_clone()
+#benchmark_moves()
+#build_pattern_databases(4, 4)
+#print obj.solve_optimal(IDAStarSolver(patterns=load_pattern_heuristic(3, 3)))
+#write_batch("puzzles.txt", 100, 4, 4)
+#solve_batch("puzzles.txt", "solutions.txt", "optimal", pattern_directory=".")
 ###
 #print obj
 ######print test1.current_position(3,2)
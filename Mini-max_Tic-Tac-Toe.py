@@ -2,9 +2,20 @@
 Mini-max Tic-Tac-Toe Player
 """
 
+import time
+import collections
 import poc_ttt_gui
 import poc_ttt_provided as provided
 
+try:
+    import ttt_book
+except ImportError:
+    ttt_book = None
+try:
+    import ttt_board
+except ImportError:
+    ttt_board = None
+
 # Set timeout, as mini-max can take a long time
 import codeskulptor
 codeskulptor.set_timeout(60)
@@ -17,6 +28,28 @@ PLAYERX = provided.PLAYERX
 PLAYERO = provided.PLAYERO
 EMPTY = provided.EMPTY
 
+# Nodes visited by mm_move, reset by benchmark_search
+SEARCH_STATS = {"mm_move": 0, "mm_move_clone": 0}
+
+# Opening book consulted by move_wrapper, see use_opening_book
+OPENING_BOOK = None
+
+def use_opening_book(path="ttt_book.bin"):
+    """
+    Load the opening book written by ttt_book.build_opening_book,
+    building it first if the file does not exist. Only use it for
+    the standard (not reverse) game.
+    Returns False if the ttt_book module is not available.
+    """
+    global OPENING_BOOK
+    if ttt_book == None:
+        return False
+    OPENING_BOOK = ttt_book.load_opening_book(path)
+    if OPENING_BOOK == None:
+        ttt_book.build_opening_book(path)
+        OPENING_BOOK = ttt_book.load_opening_book(path)
+    return True
+
 def mm_move(board, player):
     """
     Make a move on the board.
@@ -24,7 +57,45 @@ def mm_move(board, player):
     Returns a tuple with two elements.  The first element is the score
     of the given board and the second element is the desired move as a
     tuple, (row, col).
+    Searches on an IncrementalBoard, playing and taking back moves
+    in place, when ttt_board is available.
+    """
+    if ttt_board == None:
+        return mm_move_clone(board, player)
+    return mm_search(ttt_board.from_board(board), player)
+
+def mm_search(board, player):
+    """
+    mm_move on an IncrementalBoard, which is left unchanged.
     """
+    SEARCH_STATS["mm_move"] += 1
+    winner = board.check_win()
+    if winner != None:
+        return SCORES[winner], (-1, -1)
+    empty_squares = board.get_empty_squares()
+    scores = []
+    for square in empty_squares:
+        board.move(square[0], square[1], player)
+        next_score = mm_search(board, provided.switch_player(player))[0]
+        board.unmove()
+        if next_score == SCORES[player]:
+            return SCORES[player], square
+        scores.append(next_score)
+    score = SCORES[provided.switch_player(player)]
+    square = empty_squares[0]
+    for idx in range(len(empty_squares)):
+        if scores[idx] == SCORES[provided.DRAW]:
+            square = empty_squares[idx]
+            score = scores[idx]
+            break
+    return score, square
+
+def mm_move_clone(board, player):
+    """
+    mm_move cloning the board for every child, kept to benchmark
+    against the in place search.
+    """
+    SEARCH_STATS["mm_move_clone"] += 1
     winner = board.check_win()
     if winner != None:
         return SCORES[winner], (-1, -1)
@@ -39,7 +110,7 @@ def mm_move(board, player):
             next_board.move(square[0], square[1], player)
             
             #find next score with recursion
-            next_score = mm_move(next_board, provided.switch_player(player))[0]
+            next_score = mm_move_clone(next_board, provided.switch_player(player))[0]
             
             if next_score == SCORES[player]:
                 return SCORES[player], square
@@ -62,11 +133,507 @@ def move_wrapper(board, player, trials):
     """
     Wrapper to allow the use of the same infrastructure that was used
     for Monte Carlo Tic-Tac-Toe.
+    Answers from the opening book when one is loaded.
     """
+    if OPENING_BOOK != None:
+        entry = OPENING_BOOK.lookup(board, player)
+        if entry != None:
+            return entry[1]
     move = mm_move(board, player)
     assert move[1] != (-1, -1), "returned illegal move (-1, -1)"
     return move[1]
 
+# Transposition table entry flags
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# Base 3 digit of each square status in the board codes
+DIGITS = {EMPTY: 0, PLAYERX: 1, PLAYERO: 2}
+
+# Symmetries of the board and their powers of 3, by board dimension
+SYMMETRY_CACHE = {}
+
+def get_symmetries(dim):
+    """
+    Return the 8 symmetries of a dim x dim board as permutations,
+    square idx going to square perm[idx], their inverses, and for
+    each symmetry the power of 3 of every square in the code of the
+    transformed board.
+    """
+    if dim not in SYMMETRY_CACHE:
+        last = dim - 1
+        transforms = [lambda row, col: (row, col),
+                      lambda row, col: (col, last - row),
+                      lambda row, col: (last - row, last - col),
+                      lambda row, col: (last - col, row),
+                      lambda row, col: (row, last - col),
+                      lambda row, col: (col, row),
+                      lambda row, col: (last - row, col),
+                      lambda row, col: (last - col, last - row)]
+        perms = []
+        inverses = []
+        powers = []
+        for transform in transforms:
+            perm = []
+            for idx in range(dim * dim):
+                row, col = transform(idx // dim, idx % dim)
+                perm.append(row * dim + col)
+            inverse = [0] * (dim * dim)
+            for idx in range(dim * dim):
+                inverse[perm[idx]] = idx
+            perms.append(perm)
+            inverses.append(inverse)
+            powers.append([3 ** perm[idx] for idx in range(dim * dim)])
+        SYMMETRY_CACHE[dim] = (perms, inverses, powers)
+    return SYMMETRY_CACHE[dim]
+
+class AlphaBetaSearch:
+    """
+    Mini-max search with alpha-beta pruning, a transposition table
+    and move ordering (best move from the table first, then squares
+    on the most lines). PLAYERX maximizes and PLAYERO minimizes SCORES.
+    The search plays and takes back moves on an IncrementalBoard.
+    The table is keyed on the smallest base 3 code of the board over
+    its 8 symmetries and the player to move, so symmetric positions
+    share an entry; the codes of all the symmetries are updated with
+    each move.
+    """
+
+    def __init__(self):
+        self._table = {}
+        self._nodes = 0
+        self._hits = 0
+        self._cutoffs = 0
+        self._dim = None
+        self._codes = None
+
+    def get_stats(self):
+        """
+        Return a dictionary with the number of nodes visited, table
+        hits, beta cutoffs and table size.
+        """
+        return {"nodes": self._nodes, "hits": self._hits,
+                "cutoffs": self._cutoffs, "table": len(self._table)}
+
+    def order_moves(self, board, squares, best):
+        """
+        Sort the empty squares, the best known move first and then
+        the squares on the most lines.
+        """
+        dim = board.get_dim()
+        def priority(square):
+            """
+            Lower values are searched first.
+            """
+            if square == best:
+                return -dim - 3
+            lines = 2
+            if square[0] == square[1]:
+                lines += 1
+            if square[0] + square[1] == dim - 1:
+                lines += 1
+            return -lines
+        return sorted(squares, key=priority)
+
+    def search(self, board, player, alpha, beta):
+        """
+        Return the score of an IncrementalBoard and the best move as
+        a tuple, exact if it lies strictly between alpha and beta.
+        The board is left unchanged.
+        """
+        dim = board.get_dim()
+        self._dim = dim
+        self._perms, self._inverses, self._powers = get_symmetries(dim)
+        self._codes = [0] * len(self._powers)
+        for row in range(dim):
+            for col in range(dim):
+                self.update_codes(row * dim + col, DIGITS[board.square(row, col)])
+        return self.search_node(board, player, alpha, beta)
+
+    def update_codes(self, idx, digit):
+        """
+        Add digit times the power of square idx to the code of the
+        board under every symmetry.
+        """
+        codes = self._codes
+        for sym in range(len(codes)):
+            codes[sym] += digit * self._powers[sym][idx]
+
+    def search_node(self, board, player, alpha, beta):
+        """
+        search from a node whose codes are up to date.
+        """
+        self._nodes += 1
+        dim = self._dim
+        code = min(self._codes)
+        sym = self._codes.index(code)
+        key = (code, player)
+        best_known = None
+        if key in self._table:
+            flag, value, stored = self._table[key]
+            self._hits += 1
+            idx = self._inverses[sym][stored]
+            move = (idx // dim, idx % dim)
+            if flag == EXACT:
+                return value, move
+            if flag == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value, move
+            best_known = move
+
+        winner = board.check_win()
+        if winner != None:
+            return SCORES[winner], (-1, -1)
+
+        alpha_orig = alpha
+        beta_orig = beta
+        best_score = None
+        best_move = (-1, -1)
+        digit = DIGITS[player]
+        for square in self.order_moves(board, board.get_empty_squares(), best_known):
+            idx = square[0] * dim + square[1]
+            board.move(square[0], square[1], player)
+            self.update_codes(idx, digit)
+            score = self.search_node(board, provided.switch_player(player), alpha, beta)[0]
+            self.update_codes(idx, -digit)
+            board.unmove()
+            if player == PLAYERX:
+                if best_score == None or score > best_score:
+                    best_score, best_move = score, square
+                alpha = max(alpha, score)
+            else:
+                if best_score == None or score < best_score:
+                    best_score, best_move = score, square
+                beta = min(beta, score)
+            if alpha >= beta:
+                self._cutoffs += 1
+                break
+
+        if best_score <= alpha_orig:
+            flag = UPPER
+        elif best_score >= beta_orig:
+            flag = LOWER
+        else:
+            flag = EXACT
+        # The move is stored as a square of the canonical board
+        stored = self._perms[sym][best_move[0] * dim + best_move[1]]
+        self._table[key] = (flag, best_score, stored)
+        return best_score, best_move
+
+def mm_move_ab(board, player, searcher=None):
+    """
+    Same contract as mm_move, using alpha-beta pruning and a
+    transposition table. Pass the same AlphaBetaSearch to keep the
+    table between moves of a game.
+    Falls back to mm_move when ttt_board is not available.
+    """
+    if ttt_board == None:
+        return mm_move(board, player)
+    if searcher == None:
+        searcher = AlphaBetaSearch()
+    return searcher.search(ttt_board.from_board(board), player,
+                           SCORES[PLAYERO], SCORES[PLAYERX])
+
+def move_wrapper_ab(board, player, trials):
+    """
+    move_wrapper using the alpha-beta search.
+    """
+    move = mm_move_ab(board, player)
+    assert move[1] != (-1, -1), "returned illegal move (-1, -1)"
+    return move[1]
+
+def benchmark_search(board, player):
+    """
+    Run mm_move and mm_move_ab on the same board and print the
+    nodes visited and time taken by each.
+    """
+    SEARCH_STATS["mm_move"] = 0
+    start = time.time()
+    plain = mm_move(board, player)
+    plain_time = time.time() - start
+    searcher = AlphaBetaSearch()
+    start = time.time()
+    pruned = mm_move_ab(board, player, searcher)
+    pruned_time = time.time() - start
+    assert plain[0] == pruned[0], "searches disagree on the score"
+    print("mm_move: " + str(SEARCH_STATS["mm_move"]) + " nodes, " + str(plain_time) + " s")
+    print("mm_move_ab: " + str(searcher.get_stats()) + ", " + str(pruned_time) + " s")
+
+def benchmark_boards(board, player):
+    """
+    Run mm_move_clone and mm_move on the same board and print the
+    time taken with cloned boards and with the in place board.
+    """
+    start = time.time()
+    before = mm_move_clone(board, player)
+    before_time = time.time() - start
+    start = time.time()
+    after = mm_move(board, player)
+    after_time = time.time() - start
+    assert before == after, "searches disagree"
+    print("cloned boards: " + str(before_time) + " s, in place board: " +
+          str(after_time) + " s")
+
+# Iterative deepening search for larger boards.
+# Wins need K in a row (the full dimension by default). The search works
+# on a flat list of squares and checks only the lines through the last
+# move; positions at the depth cutoff are scored with WINDOW_SCORES.
+WIN_SCORE = 1000000
+TIME_BUDGET = 1.0
+TABLE_SIZE = 100000
+
+# Score of a window of K squares holding only one player's pieces,
+# indexed by the number of pieces
+WINDOW_SCORES = [0, 1, 10, 100, 1000, 10000, 100000]
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the time budget runs out.
+    """
+    pass
+
+class DeepeningSearch:
+    """
+    Negamax search with alpha-beta pruning for dim x dim boards with a
+    k in a row win rule, deepened one ply at a time until the time
+    budget runs out. The transposition table is kept between the
+    iterations and the moves of a game and its best moves are searched
+    first. It holds at most table_size positions, dropping the least
+    recently used, and is cleared when a new game starts. Win scores
+    are stored relative to the position, so entries stay valid from
+    any root.
+    reverse selects the reverse game, where making K in a row loses;
+    None detects the rules of each board with ttt_board.
+    """
+
+    def __init__(self, k_in_row=None, time_budget=TIME_BUDGET, table_size=TABLE_SIZE,
+                 reverse=None):
+        self._k_in_row = k_in_row
+        self._time_budget = time_budget
+        self._table_size = table_size
+        self._reverse = reverse
+        self._table = collections.OrderedDict()
+        self._last_empty = None
+        self._dim = None
+        self._reverse_game = None
+        self._nodes = 0
+        self._depth = 0
+
+    def setup(self, dim, reverse):
+        """
+        Precompute the windows of K squares and the square order for
+        a board of the given dimension and rules.
+        """
+        self._dim = dim
+        self._reverse_game = reverse
+        self._k = self._k_in_row or dim
+        self._table = collections.OrderedDict()
+        windows = []
+        for row in range(dim):
+            for col in range(dim):
+                for d_row, d_col in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+                    end_row = row + d_row * (self._k - 1)
+                    end_col = col + d_col * (self._k - 1)
+                    if 0 <= end_row < dim and 0 <= end_col < dim:
+                        windows.append([(row + d_row * idx) * dim + col + d_col * idx
+                                        for idx in range(self._k)])
+        self._windows = windows
+        # Squares closer to the center first
+        center = (dim - 1) / 2.0
+        self._order = sorted(range(dim * dim),
+                             key=lambda idx: abs(idx // dim - center) + abs(idx % dim - center))
+
+    def get_stats(self):
+        """
+        Return a dictionary with the nodes of the last move, the
+        depth reached and the table size.
+        """
+        return {"nodes": self._nodes, "depth": self._depth, "table": len(self._table)}
+
+    def wins(self, cells, square):
+        """
+        Check whether the piece just played on square makes K in a row.
+        """
+        dim = self._dim
+        player = cells[square]
+        row, col = square // dim, square % dim
+        for d_row, d_col in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+            count = 1
+            for sign in [1, -1]:
+                cur_row, cur_col = row + sign * d_row, col + sign * d_col
+                while 0 <= cur_row < dim and 0 <= cur_col < dim and \
+                        cells[cur_row * dim + cur_col] == player:
+                    count += 1
+                    cur_row += sign * d_row
+                    cur_col += sign * d_col
+            if count >= self._k:
+                return True
+        return False
+
+    def evaluate(self, cells, player):
+        """
+        Heuristic score of the position for player, negated in the
+        reverse game where lines are a liability.
+        """
+        other = provided.switch_player(player)
+        score = 0
+        for window in self._windows:
+            mine = 0
+            theirs = 0
+            for square in window:
+                if cells[square] == player:
+                    mine += 1
+                elif cells[square] == other:
+                    theirs += 1
+            if theirs == 0:
+                score += WINDOW_SCORES[min(mine, len(WINDOW_SCORES) - 1)]
+            elif mine == 0:
+                score -= WINDOW_SCORES[min(theirs, len(WINDOW_SCORES) - 1)]
+        if self._reverse_game:
+            return -score
+        return score
+
+    def to_table(self, value, ply):
+        """
+        Win score relative to the position at ply, to store
+        """
+        if value > WIN_SCORE - self._dim * self._dim:
+            return value + ply
+        if value < self._dim * self._dim - WIN_SCORE:
+            return value - ply
+        return value
+
+    def from_table(self, value, ply):
+        """
+        Stored win score relative to the root, for the position at ply
+        """
+        if value > WIN_SCORE - self._dim * self._dim:
+            return value - ply
+        if value < self._dim * self._dim - WIN_SCORE:
+            return value + ply
+        return value
+
+    def negamax(self, cells, player, depth, ply, alpha, beta, empty):
+        """
+        Return the score of the position for player, searching depth
+        more plies.
+        """
+        self._nodes += 1
+        if self._nodes & 0x3FF == 0 and time.time() > self._deadline:
+            raise SearchTimeout()
+        if empty == 0:
+            return 0
+        if depth == 0:
+            return self.evaluate(cells, player)
+        key = (tuple(cells), player)
+        best_known = None
+        if key in self._table:
+            entry = self._table.pop(key)
+            self._table[key] = entry
+            entry_depth, flag, value, move = entry
+            value = self.from_table(value, ply)
+            best_known = move
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return value
+                if flag == LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+        alpha_orig = alpha
+        other = provided.switch_player(player)
+        order = self._order
+        if best_known != None:
+            order = [best_known] + [square for square in order if square != best_known]
+        best_score = None
+        best_move = None
+        for square in order:
+            if cells[square] != EMPTY:
+                continue
+            cells[square] = player
+            if self.wins(cells, square):
+                score = WIN_SCORE - ply
+                if self._reverse_game:
+                    score = -score
+            else:
+                score = -self.negamax(cells, other, depth - 1, ply + 1, -beta, -alpha, empty - 1)
+            cells[square] = EMPTY
+            if best_score == None or score > best_score:
+                best_score = score
+                best_move = square
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+        if best_score <= alpha_orig:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self._table.pop(key, None)
+        self._table[key] = (depth, flag, self.to_table(best_score, ply), best_move)
+        if len(self._table) > self._table_size:
+            self._table.popitem(False)
+        return best_score
+
+    def search(self, board, player):
+        """
+        Return (score, (row, col)) for player, from the deepest
+        iteration finished in the time budget.
+        """
+        dim = board.get_dim()
+        cells = [board.square(idx // dim, idx % dim) for idx in range(dim * dim)]
+        empty = cells.count(EMPTY)
+        # Pieces are never taken back, so more empty squares than at the
+        # last move means a new game, whose rules are found once
+        if dim != self._dim or self._last_empty == None or empty > self._last_empty:
+            reverse = self._reverse
+            if reverse == None:
+                assert ttt_board != None, "pass reverse when ttt_board is not available"
+                reverse = ttt_board.detect_reverse(board)
+            self.setup(dim, reverse)
+        self._last_empty = empty
+        self._deadline = time.time() + self._time_budget
+        self._nodes = 0
+        self._depth = 0
+        key = (tuple(cells), player)
+        best = (0, (-1, -1))
+        for depth in range(1, empty + 1):
+            try:
+                score = self.negamax(cells, player, depth, 0, -WIN_SCORE - 1, WIN_SCORE + 1, empty)
+            except SearchTimeout:
+                # Undo the moves left on the board by the interrupted search
+                cells = [board.square(idx // dim, idx % dim) for idx in range(dim * dim)]
+                break
+            move = self._table[key][3]
+            best = (score, (move // dim, move % dim))
+            self._depth = depth
+            if abs(score) >= WIN_SCORE - dim * dim:
+                break
+        if best[1] == (-1, -1) and empty:
+            # Out of time before depth 1 finished
+            square = [idx for idx in self._order if cells[idx] == EMPTY][0]
+            best = (0, (square // dim, square % dim))
+        return best
+
+# One search per game, so the table survives between moves
+DEEPENING_SEARCH = DeepeningSearch()
+
+def move_wrapper_deepening(board, player, trials):
+    """
+    move_wrapper using the iterative deepening search with the
+    module time budget, for any board size.
+    """
+    move = DEEPENING_SEARCH.search(board, player)
+    assert move[1] != (-1, -1), "returned illegal move (-1, -1)"
+    return move[1]
+
 # Test game with the console or the GUI.
 # Uncomment whichever you prefer.
 # Both should be commented out when you submit for
@@ -74,6 +641,11 @@ def move_wrapper(board, player, trials):
 
 # provided.play_game(move_wrapper, 1, False)        
 # poc_ttt_gui.run_gui(3, provided.PLAYERO, move_wrapper, 1, False)
+# provided.play_game(move_wrapper_ab, 1, False)
+# use_opening_book()
+# poc_ttt_gui.run_gui(5, provided.PLAYERO, move_wrapper_deepening, 1, False)
+# benchmark_search(provided.TTTBoard(3), provided.PLAYERX)
+# benchmark_boards(provided.TTTBoard(3), provided.PLAYERX)
 
 #game =provided.TTTBoard(3, False, [[PLAYERX, EMPTY, EMPTY], [PLAYERO, PLAYERO, PLAYERX], [EMPTY, PLAYERX, EMPTY]])
 #print game
@@ -3,48 +3,178 @@ Monte Carlo Tic-Tac-Toe Player
 """
 
 import random
+import math
 import poc_ttt_gui
 import poc_ttt_provided as provided
 
+try:
+    import ttt_book
+except ImportError:
+    ttt_book = None
+try:
+    import ttt_board
+except ImportError:
+    ttt_board = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Constants for Monte Carlo simulator
 # Change as desired
 NTRIALS = 1    # Number of trials to run
 MCMATCH = 1.0  # Score for squares played by the machine player
 MCOTHER = 1.0  # Score for squares played by the other player
 
+# Opening book consulted by mc_move, see use_opening_book
+OPENING_BOOK = None
+
+def use_opening_book(path="ttt_book.bin"):
+    """
+    Load the opening book written by ttt_book.build_opening_book,
+    building it first if the file does not exist. Only use it for
+    the standard (not reverse) game.
+    Returns False if the ttt_book module is not available.
+    """
+    global OPENING_BOOK
+    if ttt_book == None:
+        return False
+    OPENING_BOOK = ttt_book.load_opening_book(path)
+    if OPENING_BOOK == None:
+        ttt_book.build_opening_book(path)
+        OPENING_BOOK = ttt_book.load_opening_book(path)
+    return True
+
 
 # Add your functions here.
-def mc_trial(board, player):
+def find_winning_square(board, player):
+    """
+    Returns an empty square that completes a line for player, or None
+    """
+    dim = board.get_dim()
+    lines = [[(row, col) for col in range(dim)] for row in range(dim)]
+    lines += [[(row, col) for row in range(dim)] for col in range(dim)]
+    lines.append([(idx, idx) for idx in range(dim)])
+    lines.append([(idx, dim - 1 - idx) for idx in range(dim)])
+    for line in lines:
+        empty = None
+        count = 0
+        for square in line:
+            status = board.square(square[0], square[1])
+            if status == player:
+                count += 1
+            elif status == provided.EMPTY and empty == None:
+                empty = square
+        if count == dim - 1 and empty != None:
+            return empty
+    return None
+
+def rollout_uniform(board, player):
+    """
+    Rollout policy: a random empty square
+    """
+    return random.choice(board.get_empty_squares())
+
+def rollout_win_first(board, player):
+    """
+    Rollout policy: a square that wins at once if there is one,
+    otherwise a random empty square
+    """
+    square = find_winning_square(board, player)
+    if square == None:
+        square = random.choice(board.get_empty_squares())
+    return square
+
+def rollout_block_first(board, player):
+    """
+    Rollout policy: a square that wins at once, otherwise a square
+    that blocks the other player from winning at once, otherwise a
+    random empty square
     """
-    Plays on game randomly
+    square = find_winning_square(board, player)
+    if square == None:
+        square = find_winning_square(board, provided.switch_player(player))
+    if square == None:
+        square = random.choice(board.get_empty_squares())
+    return square
+
+# Policy used by mc_trial to pick each move of a trial
+ROLLOUT_POLICY = rollout_uniform
+
+def mc_trial(board, player, policy=None):
+    """
+    Plays on game randomly, picking moves with policy, or with
+    ROLLOUT_POLICY when it is None
+    Returns the winner found by the last check_win
     """
+    if policy == None:
+        policy = ROLLOUT_POLICY
     current_player = player
-    while board.check_win() == None :        
-        next_square = random.choice(board.get_empty_squares())
+    winner = board.check_win()
+    while winner == None :        
+        next_square = policy(board, current_player)
         board.move(next_square[0], next_square[1], current_player)
         current_player = provided.switch_player(current_player)
+        winner = board.check_win()
+    return winner
 
     
 def mc_update_scores(scores, board, player):
     """
     Updates the score with the score of the board
     """
-    if board.check_win()== player:
+    winner = board.check_win()
+    other = provided.switch_player(player)
+    if winner == player:
         for idx in range(board.get_dim()):
             for jdx in range(board.get_dim()):
                 if board.square(idx, jdx) == player:
                     scores[idx][jdx] += MCMATCH
-                elif board.square(idx, jdx) == provided.switch_player(player):
+                elif board.square(idx, jdx) == other:
                     scores[idx][jdx] -= MCOTHER
-    elif board.check_win()== provided.switch_player(player):
-        print 
+    elif winner == other:
         for idx in range(board.get_dim()):
             for jdx in range(board.get_dim()):
                 if board.square(idx, jdx) == player:
                     scores[idx][jdx] -= MCMATCH
-                elif board.square(idx, jdx) == provided.switch_player(player):
+                elif board.square(idx, jdx) == other:
                     scores[idx][jdx] += MCOTHER         
-    
+
+def mc_update_scores_moves(scores, moves, winner, player):
+    """
+    Updates the score with the (row, col, player) moves played in a
+    trial and its known winner, without looking at the board
+    Returns 1 if player won, -1 if the other player won and 0 for
+    a draw, so the caller can score the squares that were already
+    played before the trials once with mc_update_start_scores
+    """
+    if winner == player:
+        outcome = 1
+    elif winner == provided.switch_player(player):
+        outcome = -1
+    else:
+        return 0
+    for row, col, mover in moves:
+        if mover == player:
+            scores[row][col] += outcome * MCMATCH
+        else:
+            scores[row][col] -= outcome * MCOTHER
+    return outcome
+
+def mc_update_start_scores(scores, board, player, outcomes):
+    """
+    Scores the squares already played on board for the sum of the
+    outcomes returned by mc_update_scores_moves over all trials
+    """
+    if outcomes == 0:
+        return
+    other = provided.switch_player(player)
+    for idx in range(board.get_dim()):
+        for jdx in range(board.get_dim()):
+            if board.square(idx, jdx) == player:
+                scores[idx][jdx] += outcomes * MCMATCH
+            elif board.square(idx, jdx) == other:
+                scores[idx][jdx] -= outcomes * MCOTHER
         
     
 def get_best_move(board, scores):
@@ -62,17 +192,391 @@ def get_best_move(board, scores):
     return random.choice(max_list)
             
     
-def mc_move(board, player, trials):
+def mc_move(board, player, trials, policy=None):
     """
     Applies a move
+    Answers from the opening book when one is loaded
+    policy is the rollout policy of the trials, ROLLOUT_POLICY when
+    it is None
+    """
+    if OPENING_BOOK != None:
+        entry = OPENING_BOOK.lookup(board, player)
+        if entry != None:
+            return entry[1]
+    if ttt_board == None:
+        scores = mc_scores_clone(board, player, trials, policy)
+    else:
+        scores = mc_scores(board, player, trials, policy)
+    if board.check_win() == None:
+        return get_best_move(board, scores)
+
+def mc_scores(board, player, trials, policy=None):
+    """
+    Runs the trials on one IncrementalBoard, taking back the moves
+    of each trial instead of cloning the board, and returns the scores
+    Each trial only scores the squares it played
+    """
+    scores = [ [0 for dummy_col in range(board.get_dim())] for dummy_row in range(board.get_dim())]
+    simulation = ttt_board.from_board(board)
+    outcomes = 0
+    for dummy_idx in range(trials):
+        winner = mc_trial(simulation, player, policy)
+        outcomes += mc_update_scores_moves(scores, simulation.get_moves(), winner, player)
+        simulation.unmove_all()
+    mc_update_start_scores(scores, board, player, outcomes)
+    return scores
+
+def mc_scores_clone(board, player, trials, policy=None):
+    """
+    Runs the trials on clones of the board and returns the scores
     """
     scores = [ [0 for dummy_col in range(board.get_dim())] for dummy_row in range(board.get_dim())]
     for dummy_idx in range(trials):
         simulation = board.clone()
-        mc_trial(simulation, player)
+        mc_trial(simulation, player, policy)
         mc_update_scores(scores, simulation, player)
+    return scores
+
+# Worker pool used by mc_move_parallel, created on first use
+MC_POOL = None
+MC_POOL_SIZE = 0
+MC_PROCESSES = None  # Number of worker processes, None for one per CPU
+
+def mc_scores_worker(task):
+    """
+    Runs a share of the trials in a worker process with its own
+    random stream and returns the partial scores
+    task is a tuple (board, player, trials, seed, policy name), the
+    policy being looked up by name since the workers only see the
+    module as it was when the pool started
+    """
+    board, player, trials, seed, policy_name = task
+    random.seed(seed)
+    policy = globals()[policy_name]
+    if ttt_board == None:
+        return mc_scores_clone(board, player, trials, policy)
+    return mc_scores(board, player, trials, policy)
+
+def get_pool():
+    """
+    Returns the worker pool and its number of processes,
+    creating the pool on first use
+    """
+    global MC_POOL, MC_POOL_SIZE
+    if MC_POOL == None:
+        import multiprocessing
+        MC_POOL_SIZE = MC_PROCESSES or multiprocessing.cpu_count()
+        MC_POOL = multiprocessing.Pool(MC_POOL_SIZE)
+    return MC_POOL, MC_POOL_SIZE
+
+def close_pool():
+    """
+    Stops the worker processes once they finish their tasks
+    """
+    global MC_POOL
+    if MC_POOL != None:
+        MC_POOL.close()
+        MC_POOL.join()
+        MC_POOL = None
+
+def mc_move_parallel(board, player, trials, policy=None):
+    """
+    Same as mc_move, but splits the trials over the worker pool,
+    each worker seeded from the main random stream, and adds up
+    the partial scores
+    policy must be one of the rollout policies of this module,
+    ROLLOUT_POLICY when it is None
+    """
+    if OPENING_BOOK != None:
+        entry = OPENING_BOOK.lookup(board, player)
+        if entry != None:
+            return entry[1]
+    if policy == None:
+        policy = ROLLOUT_POLICY
+    pool, workers = get_pool()
+    tasks = []
+    for idx in range(workers):
+        share = trials // workers + (idx < trials % workers)
+        if share > 0:
+            tasks.append((board, player, share, random.getrandbits(32),
+                          policy.__name__))
+    scores = [ [0 for dummy_col in range(board.get_dim())] for dummy_row in range(board.get_dim())]
+    for partial in pool.map(mc_scores_worker, tasks):
+        for row in range(board.get_dim()):
+            for col in range(board.get_dim()):
+                scores[row][col] += partial[row][col]
     if board.check_win() == None:
         return get_best_move(board, scores)
+
+def mc_scores_numpy(board, player, trials):
+    """
+    Plays all the trials at once as a (trials, dim * dim) array of
+    boards, +1 for the squares of player and -1 for the other player,
+    and returns the same scores as mc_scores
+    Every trial plays the empty squares in a random order, so each
+    move is uniform over the empty squares like mc_trial
+    """
+    dim = board.get_dim()
+    other = provided.switch_player(player)
+    start = numpy.zeros(dim * dim, dtype=numpy.int8)
+    for idx in range(dim * dim):
+        status = board.square(idx // dim, idx % dim)
+        if status == player:
+            start[idx] = 1
+        elif status == other:
+            start[idx] = -1
+    # Matrix with one row of ones per line: rows, columns and diagonals
+    lines = numpy.zeros((2 * dim + 2, dim * dim), dtype=numpy.int8)
+    for idx in range(dim):
+        lines[idx, idx * dim:(idx + 1) * dim] = 1
+        lines[dim + idx, idx::dim] = 1
+        lines[2 * dim, idx * dim + idx] = 1
+        lines[2 * dim + 1, idx * dim + dim - 1 - idx] = 1
+    empty = numpy.flatnonzero(start == 0)
+    order = empty[numpy.argsort(numpy.random.random_sample((trials, len(empty))), axis=1)]
+    boards = numpy.tile(start, (trials, 1))
+    games = numpy.arange(trials)
+    # +1 if player won the trial, -1 if the other player won, 0 for a draw
+    winners = numpy.zeros(trials, dtype=numpy.int8)
+    active = numpy.ones(trials, dtype=bool)
+    piece = 1
+    for step in range(len(empty)):
+        playing = games[active]
+        boards[playing, order[active, step]] = piece
+        sums = boards[playing].dot(lines.T)
+        won = (sums == piece * dim).any(axis=1)
+        winners[playing[won]] = piece
+        active[playing[won]] = False
+        piece = -piece
+    if ttt_board != None and ttt_board.detect_reverse(board):
+        winners = -winners
+    weights = winners.astype(float)
+    flat = MCMATCH * weights.dot(boards == 1) - MCOTHER * weights.dot(boards == -1)
+    return [[flat[row * dim + col] for col in range(dim)] for row in range(dim)]
+
+def mc_move_numpy(board, player, trials):
+    """
+    Same as mc_move, playing the trials with mc_scores_numpy
+    Falls back to mc_move when numpy is not installed
+    """
+    if numpy == None:
+        return mc_move(board, player, trials)
+    if OPENING_BOOK != None:
+        entry = OPENING_BOOK.lookup(board, player)
+        if entry != None:
+            return entry[1]
+    if board.check_win() == None:
+        return get_best_move(board, mc_scores_numpy(board, player, trials))
+
+class MCTSNode:
+    """
+    Node of the Monte Carlo search tree
+    move is the (row, col) played by player to reach the node and
+    wins counts the playouts won by player, draws counting half
+    """
+    __slots__ = ["move", "player", "parent", "children", "untried", "visits", "wins"]
+
+    def __init__(self, move, player, parent, untried):
+        self.move = move
+        self.player = player
+        self.parent = parent
+        self.children = []
+        self.untried = untried
+        self.visits = 0
+        self.wins = 0.0
+
+    def select_child(self, exploration):
+        """
+        Returns the child with the highest UCT value
+        """
+        log_visits = math.log(self.visits)
+        best = None
+        best_value = None
+        for child in self.children:
+            value = (child.wins / child.visits +
+                     exploration * math.sqrt(log_visits / child.visits))
+            if best == None or value > best_value:
+                best = child
+                best_value = value
+        return best
+
+    def find_child(self, move):
+        """
+        Returns the child reached by move, or None
+        """
+        for child in self.children:
+            if child.move == move:
+                return child
+        return None
+
+class MCTSPlayer:
+    """
+    UCT Monte Carlo tree search player
+    Keeps its tree between moves: the subtree of the position after
+    its move and the answer is reused for the next move
+    Each move runs the given number of playouts, or as many as fit
+    in time_budget seconds when it is set
+    policy is the rollout policy of the playouts, ROLLOUT_POLICY when
+    it is None
+    """
+
+    def __init__(self, time_budget=None, exploration=1.4, policy=None):
+        self._time_budget = time_budget
+        self._exploration = exploration
+        self._policy = policy
+        self._root = None
+        self._root_grid = None
+        self._root_player = None
+        self._playouts = 0
+        self._elapsed = 0.0
+        self._reused = 0
+
+    def get_stats(self):
+        """
+        Returns the playouts, time and playouts per second of all
+        moves so far and the playouts reused by the last move
+        """
+        per_second = 0.0
+        if self._elapsed > 0:
+            per_second = self._playouts / self._elapsed
+        return {"playouts": self._playouts, "seconds": self._elapsed,
+                "playouts_per_second": per_second, "reused": self._reused}
+
+    def find_root(self, board, player):
+        """
+        Returns the node of the kept tree for the board, or a new one
+        """
+        dim = board.get_dim()
+        grid = [[board.square(row, col) for col in range(dim)] for row in range(dim)]
+        node = self._root
+        if node != None and len(self._root_grid) == dim:
+            played = {}
+            for row in range(dim):
+                for col in range(dim):
+                    if self._root_grid[row][col] == provided.EMPTY:
+                        if grid[row][col] != provided.EMPTY:
+                            played[grid[row][col]] = played.get(grid[row][col], []) + [(row, col)]
+                    elif self._root_grid[row][col] != grid[row][col]:
+                        node = None
+            # Follow our move and then the answer down the tree
+            mover = self._root_player
+            while node != None and played.get(mover):
+                if len(played[mover]) > 1:
+                    node = None
+                    break
+                node = node.find_child(played.pop(mover)[0])
+                mover = provided.switch_player(mover)
+            if played or mover != player:
+                node = None
+        if node == None:
+            node = MCTSNode(None, provided.switch_player(player), None,
+                            board.get_empty_squares())
+        node.parent = None
+        self._root = node
+        self._root_grid = grid
+        self._root_player = player
+        return node
+
+    def get_move(self, board, player, playouts):
+        """
+        Runs the search and returns the most visited move
+        Runs at least one playout, even with no playouts or time left
+        """
+        import time
+        start = time.time()
+        root = self.find_root(board, player)
+        self._reused = root.visits
+        simulation = ttt_board.from_board(board)
+        count = 0
+        while True:
+            # Always run one playout so the root has a child to pick
+            if self._time_budget != None:
+                done = time.time() - start >= self._time_budget
+            else:
+                done = count >= playouts
+            if done and count > 0:
+                break
+            self.playout(root, simulation)
+            simulation.unmove_all()
+            count += 1
+        self._playouts += count
+        self._elapsed += time.time() - start
+        best = max(root.children, key=lambda child: child.visits)
+        return best.move
+
+    def playout(self, root, simulation):
+        """
+        Selects down the tree, expands one node, plays randomly to
+        the end and updates the nodes on the path
+        """
+        node = root
+        while not node.untried and node.children:
+            node = node.select_child(self._exploration)
+            simulation.move(node.move[0], node.move[1], node.player)
+        if node.untried and simulation.check_win() == None:
+            move = node.untried.pop(random.randrange(len(node.untried)))
+            player = provided.switch_player(node.player)
+            simulation.move(move[0], move[1], player)
+            untried = []
+            if simulation.check_win() == None:
+                untried = simulation.get_empty_squares()
+            child = MCTSNode(move, player, node, untried)
+            node.children.append(child)
+            node = child
+        mc_trial(simulation, provided.switch_player(node.player), self._policy)
+        winner = simulation.check_win()
+        while node != None:
+            node.visits += 1
+            if winner == node.player:
+                node.wins += 1.0
+            elif winner == provided.DRAW:
+                node.wins += 0.5
+            node = node.parent
+
+# Player used by mcts_move, keeps its tree between moves
+MCTS_PLAYER = MCTSPlayer()
+
+def mcts_move(board, player, trials):
+    """
+    Same contract as mc_move, using the Monte Carlo tree search with
+    trials playouts per move
+    """
+    if ttt_board == None:
+        return mc_move(board, player, trials)
+    if board.check_win() == None:
+        return MCTS_PLAYER.get_move(board, player, trials)
+
+def benchmark_trials(board, player, trials):
+    """
+    Times the trials on cloned boards, on the in place board, with
+    mc_move against mc_move_parallel on the worker pool, and with
+    the numpy batch
+    """
+    import time
+    start = time.time()
+    mc_scores_clone(board, player, trials)
+    before_time = time.time() - start
+    start = time.time()
+    mc_scores(board, player, trials)
+    after_time = time.time() - start
+    print("cloned boards: " + str(before_time) + " s, in place board: " +
+          str(after_time) + " s")
+    if board.check_win() == None:
+        # Start the pool first so its start up is not timed
+        workers = get_pool()[1]
+        start = time.time()
+        mc_move(board, player, trials)
+        serial_time = time.time() - start
+        start = time.time()
+        mc_move_parallel(board, player, trials)
+        parallel_time = time.time() - start
+        print("mc_move: " + str(serial_time) + " s, mc_move_parallel on " +
+              str(workers) + " workers: " + str(parallel_time) + " s, speedup " +
+              str(serial_time / max(parallel_time, 1e-9)))
+    if numpy != None:
+        start = time.time()
+        mc_scores_numpy(board, player, trials)
+        print("numpy batch: " + str(time.time() - start) + " s")
       
     #player = provided.switch_player(player)
         
@@ -88,4 +592,11 @@ def mc_move(board, player, trials):
 # testing to save time.
 
 #provided.play_game(mc_move, NTRIALS, False)        
+#use_opening_book()
+#benchmark_trials(provided.TTTBoard(3), provided.PLAYERX, 10000)
+#ROLLOUT_POLICY = rollout_block_first
+#provided.play_game(mc_move_parallel, 20000, False)
+#provided.play_game(mc_move_numpy, 20000, False)
+#provided.play_game(mcts_move, 2000, False)
+#print MCTS_PLAYER.get_stats()
 #poc_ttt_gui.run_gui(3, provided.PLAYERX, mc_move, NTRIALS, False)
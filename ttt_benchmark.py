@@ -0,0 +1,254 @@
+"""
+Benchmark suite for the Tic-Tac-Toe players
+Plays the players of Mini-max_Tic-Tac-Toe.py and
+Monte_Carlo_Tic-Tac-Toe.py against each other on several board sizes
+and reports win/draw/loss rates, per move latency percentiles, nodes
+or playouts per second and, optionally, peak memory per move.
+"""
+
+import os
+import time
+import poc_ttt_provided as provided
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PERCENTILES = [50, 90, 99]
+
+def load_script(name, filename):
+    """
+    Import one of the game scripts, whose file names are not valid
+    module names.
+    """
+    path = os.path.join(HERE, filename)
+    try:
+        import importlib.util
+    except ImportError:
+        import imp
+        return imp.load_source(name, path)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class Player:
+    """
+    A move function with the move_wrapper(board, player, trials)
+    signature, its trials argument and a function returning the work
+    done so far (search nodes or playouts). minimax only handles 3x3
+    boards in reasonable time.
+    """
+
+    def __init__(self, name, move_function, trials, work):
+        self.name = name
+        self.move_function = move_function
+        self.trials = trials
+        self.work = work
+        self.latencies = []
+        self.work_done = 0
+        self.peak_memory = 0
+
+    def move(self, board, player, measure_memory):
+        """
+        Return the move of the player, recording its latency, work
+        and peak memory.
+        """
+        if measure_memory and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        work = self.work()
+        start = time.time()
+        move = self.move_function(board, player, self.trials)
+        self.latencies.append(time.time() - start)
+        self.work_done += self.work() - work
+        if measure_memory:
+            self.peak_memory = max(self.peak_memory, tracemalloc.get_traced_memory()[1])
+        return move
+
+def make_players(trials=1000):
+    """
+    Return a dictionary of all the available players by name.
+    Monte Carlo players run trials playouts per move. Each one passes
+    its rollout policy explicitly, so the players never change the
+    ROLLOUT_POLICY of the module and do not affect each other.
+    """
+    minimax = load_script("ttt_minimax", "Mini-max_Tic-Tac-Toe.py")
+    monte_carlo = load_script("ttt_monte_carlo", "Monte_Carlo_Tic-Tac-Toe.py")
+    # Work done so far by the players without a counter of their own
+    counters = {"playouts": 0, "deepening": 0}
+    searcher = minimax.AlphaBetaSearch()
+    mcts = monte_carlo.MCTSPlayer(policy=monte_carlo.rollout_uniform)
+
+    def mc_player(move_function):
+        """
+        Wrap a Monte Carlo move function to count its playouts.
+        """
+        def counted(board, player, trials):
+            """
+            Counted move function.
+            """
+            counters["playouts"] += trials
+            return move_function(board, player, trials)
+        return counted
+
+    def policy_move(policy):
+        """
+        Return mc_move playing its trials with a rollout policy.
+        """
+        def move(board, player, trials):
+            """
+            Monte Carlo move with the rollout policy.
+            """
+            return monte_carlo.mc_move(board, player, trials, policy)
+        return move
+
+    def mcts_move(board, player, trials):
+        """
+        Tree search move with uniform rollouts, keeping its tree
+        between moves.
+        """
+        return mcts.get_move(board, player, trials)
+
+    def alphabeta_move(board, player, trials):
+        """
+        Alpha-beta move keeping its table between moves.
+        """
+        return minimax.mm_move_ab(board, player, searcher)[1]
+
+    def deepening_move(board, player, trials):
+        """
+        Deepening move adding up the nodes of every move.
+        """
+        move = minimax.move_wrapper_deepening(board, player, trials)
+        counters["deepening"] += minimax.DEEPENING_SEARCH.get_stats()["nodes"]
+        return move
+
+    players = {
+        "minimax": Player("minimax", minimax.move_wrapper, 1,
+                          lambda: minimax.SEARCH_STATS["mm_move"]),
+        "alphabeta": Player("alphabeta", alphabeta_move, 1,
+                            lambda: searcher.get_stats()["nodes"]),
+        "deepening": Player("deepening", deepening_move, 1,
+                            lambda: counters["deepening"]),
+        "mcts": Player("mcts", mcts_move, trials,
+                       lambda: mcts.get_stats()["playouts"])}
+    for name, policy in [("uniform", monte_carlo.rollout_uniform),
+                         ("win_first", monte_carlo.rollout_win_first),
+                         ("block_first", monte_carlo.rollout_block_first)]:
+        players["mc_" + name] = Player("mc_" + name, mc_player(policy_move(policy)), trials,
+                                       lambda: counters["playouts"])
+    if monte_carlo.numpy != None:
+        players["mc_numpy"] = Player("mc_numpy", mc_player(monte_carlo.mc_move_numpy), trials,
+                                     lambda: counters["playouts"])
+    return players
+
+def play_game(player_x, player_o, dim, measure_memory):
+    """
+    Play one game on a dim x dim board, PLAYERX moving first.
+    Returns the winner.
+    """
+    board = provided.TTTBoard(dim)
+    players = {provided.PLAYERX: player_x, provided.PLAYERO: player_o}
+    current = provided.PLAYERX
+    while board.check_win() == None:
+        row, col = players[current].move(board, current, measure_memory)
+        assert board.square(row, col) == provided.EMPTY, "illegal move"
+        board.move(row, col, current)
+        current = provided.switch_player(current)
+    return board.check_win()
+
+def percentile(values, percent):
+    """
+    Nearest rank percentile of a list of numbers.
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(int(round(percent / 100.0 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+def run_match(player_a, player_b, dim, games, measure_memory=False):
+    """
+    Play games games between two players, swapping sides every game.
+    Returns a dictionary with the wins, draws and losses of player_a
+    and the latency, throughput and memory of both players.
+    """
+    result = {"dim": dim, "games": games, "wins": 0, "draws": 0, "losses": 0}
+    for player in [player_a, player_b]:
+        player.latencies = []
+        player.work_done = 0
+        player.peak_memory = 0
+    for game in range(games):
+        if game % 2 == 0:
+            winner = play_game(player_a, player_b, dim, measure_memory)
+            a_side = provided.PLAYERX
+        else:
+            winner = play_game(player_b, player_a, dim, measure_memory)
+            a_side = provided.PLAYERO
+        if winner == provided.DRAW:
+            result["draws"] += 1
+        elif winner == a_side:
+            result["wins"] += 1
+        else:
+            result["losses"] += 1
+    for key, player in [("a", player_a), ("b", player_b)]:
+        total = sum(player.latencies)
+        result[key] = {"name": player.name,
+                       "moves": len(player.latencies),
+                       "latency": [percentile(player.latencies, percent)
+                                   for percent in PERCENTILES],
+                       "work_per_second": player.work_done / max(total, 1e-9),
+                       "peak_memory": player.peak_memory}
+    return result
+
+def print_result(result):
+    """
+    Print the result of run_match.
+    """
+    games = float(result["games"])
+    print("%s vs %s on %dx%d: win %.0f%% draw %.0f%% loss %.0f%%" % (
+        result["a"]["name"], result["b"]["name"], result["dim"], result["dim"],
+        100 * result["wins"] / games, 100 * result["draws"] / games,
+        100 * result["losses"] / games))
+    for key in ["a", "b"]:
+        stats = result[key]
+        latency = ", ".join(["p%d %.2f ms" % (percent, 1000 * value)
+                             for percent, value in zip(PERCENTILES, stats["latency"])])
+        line = "    %-14s %s, %.0f nodes or playouts/s" % (stats["name"], latency,
+                                                          stats["work_per_second"])
+        if stats["peak_memory"]:
+            line += ", peak %.1f KiB" % (stats["peak_memory"] / 1024.0)
+        print(line)
+
+def run_benchmark(pairs, dims=(3,), games=20, trials=1000, measure_memory=False):
+    """
+    Run and print every pair of player names on every board size.
+    Memory is measured with tracemalloc, which slows the players down.
+    Returns the list of results.
+    """
+    players = make_players(trials)
+    if measure_memory:
+        assert tracemalloc != None, "peak memory needs tracemalloc"
+        tracemalloc.start()
+    results = []
+    try:
+        for dim in dims:
+            for name_a, name_b in pairs:
+                result = run_match(players[name_a], players[name_b], dim, games,
+                                   measure_memory)
+                print_result(result)
+                results.append(result)
+    finally:
+        if measure_memory:
+            tracemalloc.stop()
+    return results
+
+if __name__ == "__main__":
+    run_benchmark([("mc_uniform", "mc_win_first"),
+                   ("mc_uniform", "mc_block_first"),
+                   ("mc_block_first", "minimax"),
+                   ("mcts", "minimax")], dims=(3,), games=10, trials=300)
+    run_benchmark([("mcts", "deepening"), ("mc_block_first", "mcts")],
+                  dims=(4,), games=4, trials=300)
@@ -0,0 +1,202 @@
+"""
+Tic-Tac-Toe board for search and simulation
+Same interface as poc_ttt_provided.TTTBoard plus unmove, so searches
+can play and take back moves in place instead of cloning. Each
+player's squares are a bitmask and every line keeps a count of each
+player's pieces, so check_win after a move takes constant time.
+"""
+
+import poc_ttt_provided as provided
+
+EMPTY = provided.EMPTY
+PLAYERX = provided.PLAYERX
+PLAYERO = provided.PLAYERO
+DRAW = provided.DRAW
+
+# Lines and the lines through each square, by board dimension
+LINE_CACHE = {}
+
+def get_lines(dim):
+    """
+    Return the list of lines (rows, columns and both diagonals) of
+    a dim x dim board as lists of squares, and for each square the
+    indices of the lines through it.
+    """
+    if dim not in LINE_CACHE:
+        lines = []
+        for row in range(dim):
+            lines.append([row * dim + col for col in range(dim)])
+        for col in range(dim):
+            lines.append([row * dim + col for row in range(dim)])
+        lines.append([idx * dim + idx for idx in range(dim)])
+        lines.append([idx * dim + dim - 1 - idx for idx in range(dim)])
+        square_lines = [[] for dummy_idx in range(dim * dim)]
+        for line_idx in range(len(lines)):
+            for square in lines[line_idx]:
+                square_lines[square].append(line_idx)
+        LINE_CACHE[dim] = (lines, square_lines)
+    return LINE_CACHE[dim]
+
+def detect_reverse(board):
+    """
+    Find out whether a TTTBoard plays the reverse game, where the
+    player completing a line loses, by completing a line on a clone.
+    Returns False when no line can be completed any more.
+    """
+    dim = board.get_dim()
+    for line in get_lines(dim)[0]:
+        owners = set([board.square(square // dim, square % dim) for square in line])
+        owners.discard(EMPTY)
+        if len(owners) > 1:
+            continue
+        player = PLAYERX
+        if owners:
+            player = owners.pop()
+        test_board = board.clone()
+        for square in line:
+            test_board.move(square // dim, square % dim, player)
+        return test_board.check_win() == provided.switch_player(player)
+    return False
+
+class IncrementalBoard:
+    """
+    Board with in place moves and constant time win detection.
+    """
+
+    def __init__(self, dim, reverse=False, board=None):
+        self._dim = dim
+        self._reverse = reverse
+        self._lines, self._square_lines = get_lines(dim)
+        self._full = (1 << (dim * dim)) - 1
+        self._masks = {PLAYERX: 0, PLAYERO: 0}
+        self._counts = {PLAYERX: [0] * len(self._lines),
+                        PLAYERO: [0] * len(self._lines)}
+        self._moves = []
+        self._winners = [None]
+        if board != None:
+            for row in range(dim):
+                for col in range(dim):
+                    if board[row][col] != EMPTY:
+                        self.move(row, col, board[row][col])
+            self._moves = []
+            self._winners = [self._winners[-1]]
+
+    def __str__(self):
+        """
+        Human readable representation of the board.
+        """
+        return str(provided.TTTBoard(self._dim, self._reverse, self.get_grid()))
+
+    def get_dim(self):
+        """
+        Return the dimension of the board.
+        """
+        return self._dim
+
+    def get_grid(self):
+        """
+        Return the board as a list of rows.
+        """
+        return [[self.square(row, col) for col in range(self._dim)]
+                for row in range(self._dim)]
+
+    def get_mask(self, player):
+        """
+        Return the bitmask of the squares of player, bit
+        row * dim + col for square (row, col).
+        """
+        return self._masks[player]
+
+    def get_moves(self):
+        """
+        Return the list of (row, col, player) moves played since the
+        board was created, in order.
+        """
+        return list(self._moves)
+
+    def square(self, row, col):
+        """
+        Return the status (EMPTY, PLAYERX, PLAYERO) of square (row, col).
+        """
+        bit = 1 << (row * self._dim + col)
+        if self._masks[PLAYERX] & bit:
+            return PLAYERX
+        if self._masks[PLAYERO] & bit:
+            return PLAYERO
+        return EMPTY
+
+    def get_empty_squares(self):
+        """
+        Return a list of (row, col) tuples for all empty squares,
+        in row major order like TTTBoard.
+        """
+        full = self._masks[PLAYERX] | self._masks[PLAYERO]
+        dim = self._dim
+        return [(idx // dim, idx % dim) for idx in range(dim * dim) if not (full >> idx) & 1]
+
+    def move(self, row, col, player):
+        """
+        Place player on square (row, col) if it is empty, updating
+        the line counts and the winner.
+        """
+        square = row * self._dim + col
+        bit = 1 << square
+        if (self._masks[PLAYERX] | self._masks[PLAYERO]) & bit:
+            return
+        self._masks[player] |= bit
+        counts = self._counts[player]
+        winner = self._winners[-1]
+        for line_idx in self._square_lines[square]:
+            counts[line_idx] += 1
+            if counts[line_idx] == self._dim and winner == None:
+                winner = player
+                if self._reverse:
+                    winner = provided.switch_player(player)
+        self._moves.append((row, col, player))
+        self._winners.append(winner)
+
+    def unmove(self):
+        """
+        Take back the last move.
+        """
+        row, col, player = self._moves.pop()
+        self._winners.pop()
+        square = row * self._dim + col
+        self._masks[player] &= ~(1 << square)
+        counts = self._counts[player]
+        for line_idx in self._square_lines[square]:
+            counts[line_idx] -= 1
+
+    def unmove_all(self):
+        """
+        Take back every move played since the board was created.
+        """
+        while self._moves:
+            self.unmove()
+
+    def check_win(self):
+        """
+        Return PLAYERX or PLAYERO if that player won, DRAW if the
+        board is full and None if the game is not over.
+        """
+        winner = self._winners[-1]
+        if winner != None:
+            return winner
+        if self._masks[PLAYERX] | self._masks[PLAYERO] == self._full:
+            return DRAW
+        return None
+
+    def clone(self):
+        """
+        Return a copy of the board, without the move history.
+        """
+        return IncrementalBoard(self._dim, self._reverse, self.get_grid())
+
+def from_board(board):
+    """
+    Return an IncrementalBoard with the position and rules of a
+    TTTBoard (or any board with the same interface).
+    """
+    dim = board.get_dim()
+    grid = [[board.square(row, col) for col in range(dim)] for row in range(dim)]
+    return IncrementalBoard(dim, detect_reverse(board), grid)
@@ -0,0 +1,184 @@
+"""
+Opening book for 3x3 Tic-Tac-Toe
+Every position reachable from the empty board (PLAYERX moving first)
+is solved once, reduced under the 8 symmetries of the board and stored
+in a packed array of one byte per base 3 board code, so looking up a
+position is a constant number of operations on a memory mapped file.
+Only for the standard game, not the reverse one.
+"""
+
+import mmap
+import poc_ttt_provided as provided
+
+DIM = 3
+NUM_CODES = 3 ** (DIM * DIM)
+DEFAULT_PATH = "ttt_book.bin"
+
+# Digit of each square in a board code
+DIGITS = {provided.EMPTY: 0, provided.PLAYERX: 1, provided.PLAYERO: 2}
+
+# Byte layout: low 4 bits best square (row * 3 + col), next 2 bits value
+NO_ENTRY = 0
+VALUE_CODES = {1: 1, 0: 2, -1: 3}
+CODE_VALUES = {1: 1, 2: 0, 3: -1}
+
+LINES = [[0, 1, 2], [3, 4, 5], [6, 7, 8], [0, 3, 6],
+         [1, 4, 7], [2, 5, 8], [0, 4, 8], [2, 4, 6]]
+
+def make_symmetries():
+    """
+    Return the 8 symmetries of the board as permutations: square
+    idx of a board goes to square perm[idx] of the transformed board.
+    """
+    transforms = [lambda row, col: (row, col),
+                  lambda row, col: (col, DIM - 1 - row),
+                  lambda row, col: (DIM - 1 - row, DIM - 1 - col),
+                  lambda row, col: (DIM - 1 - col, row),
+                  lambda row, col: (row, DIM - 1 - col),
+                  lambda row, col: (col, row),
+                  lambda row, col: (DIM - 1 - row, col),
+                  lambda row, col: (DIM - 1 - col, DIM - 1 - row)]
+    perms = []
+    for transform in transforms:
+        perm = []
+        for idx in range(DIM * DIM):
+            row, col = transform(idx // DIM, idx % DIM)
+            perm.append(row * DIM + col)
+        perms.append(perm)
+    return perms
+
+SYMMETRIES = make_symmetries()
+
+def encode(cells):
+    """
+    Base 3 code of a list of 9 digits.
+    """
+    code = 0
+    for idx in range(DIM * DIM - 1, -1, -1):
+        code = code * 3 + cells[idx]
+    return code
+
+def canonical(cells):
+    """
+    Return the smallest code over the 8 symmetries of the cells
+    and the permutation that gives it.
+    """
+    best_code = None
+    best_perm = None
+    for perm in SYMMETRIES:
+        moved = [0] * (DIM * DIM)
+        for idx in range(DIM * DIM):
+            moved[perm[idx]] = cells[idx]
+        code = encode(moved)
+        if best_code == None or code < best_code:
+            best_code = code
+            best_perm = perm
+    return best_code, best_perm
+
+def winner(cells):
+    """
+    Return 1 or 2 if that digit completed a line, 0 for a draw
+    and None if the game is not over.
+    """
+    for line in LINES:
+        first = cells[line[0]]
+        if first != 0 and first == cells[line[1]] == cells[line[2]]:
+            return first
+    if 0 not in cells:
+        return 0
+    return None
+
+def build_opening_book(path=DEFAULT_PATH):
+    """
+    Solve every reachable position and write the packed book to path.
+    Returns the number of canonical positions stored.
+    """
+    book = bytearray(NUM_CODES)
+    solved = {}
+    scores = {1: 1, 2: -1, 0: 0}
+
+    def solve(cells, digit):
+        """
+        Return the value of the position for PLAYERX, storing the
+        canonical positions and their best moves in the book.
+        """
+        code, perm = canonical(cells)
+        if code in solved:
+            return solved[code]
+        result = winner(cells)
+        if result != None:
+            solved[code] = scores[result]
+            return solved[code]
+        best_value = None
+        best_square = None
+        for square in range(DIM * DIM):
+            if cells[square] != 0:
+                continue
+            cells[square] = digit
+            value = solve(cells, 3 - digit)
+            cells[square] = 0
+            if (best_value == None or (digit == 1 and value > best_value) or
+                    (digit == 2 and value < best_value)):
+                best_value = value
+                best_square = square
+        solved[code] = best_value
+        book[code] = (VALUE_CODES[best_value] << 4) | perm[best_square]
+        return best_value
+
+    solve([0] * (DIM * DIM), 1)
+    book_file = open(path, "wb")
+    book_file.write(book)
+    book_file.close()
+    return len([byte for byte in book if byte != NO_ENTRY])
+
+class OpeningBook:
+    """
+    Read only view of a book file written by build_opening_book.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self._file = open(path, "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        assert len(self._data) == NUM_CODES, "not an opening book: " + path
+
+    def close(self):
+        """
+        Release the file.
+        """
+        self._data.close()
+        self._file.close()
+
+    def lookup(self, board, player):
+        """
+        Return (score, (row, col)) like mm_move for a 3x3 board with
+        player to move, or None if the position is not in the book.
+        """
+        if board.get_dim() != DIM:
+            return None
+        cells = [DIGITS[board.square(idx // DIM, idx % DIM)] for idx in range(DIM * DIM)]
+        # The book only has PLAYERX moving first
+        if cells.count(1) - cells.count(2) != (player == provided.PLAYERO):
+            return None
+        code, perm = canonical(cells)
+        entry = ord(self._data[code:code + 1])
+        if entry == NO_ENTRY:
+            return None
+        square = perm.index(entry & 0xF)
+        return CODE_VALUES[entry >> 4], (square // DIM, square % DIM)
+
+def load_opening_book(path=DEFAULT_PATH):
+    """
+    Return the OpeningBook at path, or None if there is no such file.
+    """
+    try:
+        return OpeningBook(path)
+    except (IOError, OSError):
+        return None
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1:
+        BOOK_PATH = sys.argv[1]
+    else:
+        BOOK_PATH = DEFAULT_PATH
+    print("stored " + str(build_opening_book(BOOK_PATH)) + " positions in " + BOOK_PATH)